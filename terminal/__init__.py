@@ -8,12 +8,26 @@
 This is the top level __init__.py for terminal
 """
 
+from .aio import AsyncSerialPort, AsyncTerminal
+from .metrics import Metrics
+from .pool import TerminalPool
+from .profile import ProfileCache
+from .screen import Screen
 from .serial import SerialPort
-from .terminal import Terminal
+from .terminal import QueuedTerminal, Terminal
+from .threaded import ThreadedTerminal
 
 __all__ = [
+    "AsyncSerialPort",
+    "AsyncTerminal",
+    "Metrics",
+    "ProfileCache",
+    "QueuedTerminal",
+    "Screen",
     "SerialPort",
     "Terminal",
+    "TerminalPool",
+    "ThreadedTerminal",
 ]
 
 # -*- coding: utf-8 -*-
@@ -0,0 +1,303 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module provides asyncio versions of SerialPort and Terminal, so one
+event loop can drive many terminals.
+"""
+import asyncio
+import selectors
+import time
+
+from .serial import SerialPort
+from .terminal import QueuedTerminal, Terminal
+
+class AsyncSerialPort(SerialPort):
+    """ A SerialPort whose reads and writes are coroutines that wait on the
+    running event loop instead of blocking """
+
+    # {event: set of futures} for everyone waiting on the port.  The loop
+    # only keeps one reader and one writer per fd, so we keep one of each
+    # for as long as anybody is waiting, and it wakes all of them.
+    _async_waiters = None
+
+    def _async_wake(self, event):
+        """ The port is ready for event; wake everyone waiting for it """
+        waiters = self._async_waiters[event]
+        while waiters:
+            ready = waiters.pop()
+            if not ready.done():
+                ready.set_result(True)
+
+    async def _wait_async(self, events, timeout=None):
+        """ Wait up to timeout for the port to be ready for events.  Returns
+        True if it is, False if we timed out. """
+        loop = asyncio.get_running_loop()
+        if self._async_waiters is None:
+            self._async_waiters = {selectors.EVENT_READ: set(),
+                                   selectors.EVENT_WRITE: set()}
+        watchers = (
+            (selectors.EVENT_READ, loop.add_reader, loop.remove_reader),
+            (selectors.EVENT_WRITE, loop.add_writer, loop.remove_writer),
+        )
+        ready = loop.create_future()
+
+        for event, watch, _ in watchers:
+            if events & event:
+                waiters = self._async_waiters[event]
+                if not waiters:
+                    watch(self.filedes, self._async_wake, event)
+                waiters.add(ready)
+        try:
+            return await asyncio.wait_for(ready, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            for event, _, unwatch in watchers:
+                if events & event:
+                    waiters = self._async_waiters[event]
+                    waiters.discard(ready)
+                    if not waiters:
+                        unwatch(self.filedes)
+
+    async def _fill_input_async(self, timeout=None):
+        """ Like _fill_input(), but waits on the event loop """
+        if not await self._wait_async(selectors.EVENT_READ, timeout):
+            return 0
+        return self._read_available()
+
+    @staticmethod
+    def _remaining(deadline):
+        """ How long until deadline, or None if there isn't one """
+        if deadline is None:
+            return None
+        return max(deadline - time.monotonic(), 0)
+
+    async def read(self, count=None, timeout=None):
+        """ read from our port """
+        # pylint: disable=invalid-overridden-method
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while count is None or len(self._rbuf) < count:
+            if not await self._fill_input_async(self._remaining(deadline)) \
+                    and deadline is not None \
+                    and time.monotonic() >= deadline:
+                raise TimeoutError(self._take_input())
+
+        return self._take_input(count)
+
+    async def readline(self, timeout=None, max_line=None):
+        """ read a line from our port; see SerialPort.readline() """
+        # pylint: disable=invalid-overridden-method
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        start = 0
+        while True:
+            line = self._next_line(start, max_line)
+            if line is not None:
+                return line
+            start = len(self._rbuf)
+
+            if not await self._fill_input_async(self._remaining(deadline)) \
+                    and deadline is not None \
+                    and time.monotonic() >= deadline:
+                raise TimeoutError(bytes(self._rbuf))
+
+    async def readlines(self, timeout=None, max_line=None):
+        """ Generate lines from our port as they arrive, until one takes
+        longer than timeout to show up """
+        # pylint: disable=invalid-overridden-method
+        while True:
+            try:
+                yield await self.readline(timeout, max_line)
+            except TimeoutError:
+                return
+
+    async def write(self, buf, timeout=None):
+        """ write to our serial port; see SerialPort.write() """
+        # pylint: disable=invalid-overridden-method
+
+        if isinstance(buf, str):
+            buf = buf.encode('utf-8')
+        view = memoryview(buf).cast('B')
+        total = len(view)
+        ret = 0
+
+        deadline = None
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        while ret < total:
+            try:
+                ret += self._write_some(view[ret:])
+                continue
+            except BlockingIOError:
+                pass
+
+            if not await self._wait_async(selectors.EVENT_WRITE,
+                                          self._remaining(deadline)):
+                raise TimeoutError(ret)
+
+        return ret
+
+class AsyncTerminal(AsyncSerialPort, QueuedTerminal):
+    """ A Terminal for asyncio.
+
+    All the drawing methods from Terminal work as usual, but they only queue
+    their output, along with the pacing delays fill() would have slept for.
+    "await term.drain()" sends the queue, waiting out each delay on the
+    event loop before sending whatever comes after it.  write(), the
+    queries (getpos(), DSR(), DA(), check_position()), and setup() are
+    coroutines.
+
+    As with QueuedTerminal, the cursor model is always trusted.
+
+    Anything that would block waiting for an answer, like Query.result(),
+    read_Ps_response() or CPR(), raises RuntimeError instead of stalling
+    the event loop; await Query.wait() or the async queries instead.
+    """
+
+    def __init__(self, name, use_pty=False, selector=None, profiles=None,
+                 fast_probe=False, metrics=None):
+        # pylint: disable=too-many-arguments
+        QueuedTerminal.__init__(self, name, use_pty, selector=selector,
+                                profiles=profiles, fast_probe=fast_probe,
+                                metrics=metrics)
+        self._drain_lock = None
+
+    async def drain(self):
+        """ Send everything queued so far, honoring the delays """
+        # pylint: disable=invalid-overridden-method
+        self.flush()
+        if self._drain_lock is None:
+            self._drain_lock = asyncio.Lock()
+        async with self._drain_lock:
+            while self._segments:
+                data, fill = self._segments.popleft()
+                wait = self.pacer.wait_time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                if data:
+                    self.pacer.sent(await AsyncSerialPort.write(self, data))
+                if fill:
+                    self.pacer.delay(fill)
+
+    async def write(self, buf, timeout=None, limit=None):
+        """ Write text to the screen """
+        # pylint: disable=arguments-differ,invalid-overridden-method
+        Terminal.write(self, buf, limit=limit)
+        await self.drain()
+
+    async def _parse_input_async(self, timeout=None):
+        """ Like _parse_input(), but waits on the event loop """
+        if not self._rbuf and not await self._fill_input_async(timeout):
+            return 0
+        data = self._take_input()
+        self._dispatch(self.parser.feed(data))
+        return len(data)
+
+    async def get_event(self, timeout=None):
+        """ Get the next thing the terminal has sent us, or None if nothing
+        shows up within timeout """
+        # pylint: disable=invalid-overridden-method
+        while not self._events:
+            if not await self._parse_input_async(timeout):
+                return None
+        return self._events.pop(0)
+
+    def _pump_until(self, ready, timeout=None):
+        """ Waiting here would block the event loop """
+        raise RuntimeError("%s: await the answer on an AsyncTerminal" %
+                           (self.name,))
+
+    async def _pump_until_async(self, ready, timeout=None):
+        """ Like _pump_until(), but waits on the event loop """
+        await self.drain()
+        timeout = self._get_timeout(timeout)
+        done_at = self.pacer.done_at()
+        idle = 0
+        while not ready():
+            if await self._parse_input_async(timeout):
+                idle = 0
+            elif time.monotonic() >= done_at:
+                idle += 1
+                if idle == 4:
+                    raise TimeoutError(timeout * idle)
+
+    async def _ask_async(self, query):
+        """ Like _ask(), but waits on the event loop """
+        while True:
+            try:
+                return await query.wait()
+            except TimeoutError:
+                self._query_timed_out(query)
+                await self.discard_input()
+                if query.once:
+                    return None
+                query = query.retry()
+
+    async def discard_input(self):
+        """ Throw away input until the terminal goes quiet, like
+        Terminal.drain() """
+        self._forget_input()
+        count = 0
+        while count < 4:
+            if await self._fill_input_async(self._get_timeout()):
+                self._rbuf.clear()
+                count = 0
+            else:
+                count += 1
+
+    async def DSR(self, n: int = 0):
+        """ Device Status Report """
+        # pylint: disable=invalid-overridden-method
+        if n == 5:
+            return await self.query_status().wait()
+        if n == 6:
+            return await self._ask_async(self.query_position())
+        self.escape("[%dn" % (n,))
+        self.fill(2000)
+        await self.drain()
+        return None
+
+    async def getpos(self):
+        """ get current (x, y) """
+        # pylint: disable=invalid-overridden-method
+        return await self.DSR(6)
+
+    async def DA(self):
+        """ Query device attributes """
+        # pylint: disable=invalid-overridden-method
+        return await self.query_attributes().wait()
+
+    async def check_position(self):
+        """ Get the position from the terminal and ensure that we're at the
+        right place."""
+        # pylint: disable=invalid-overridden-method
+        x, y = await self.getpos()
+        self._correct_position(x, y)
+        await self.drain()
+
+    async def setup(self):
+        """ Actually set up the terminal for drawing to """
+        # pylint: disable=invalid-overridden-method
+        steps = self._setup_steps()
+        result = None
+        while True:
+            try:
+                query = steps.send(result)
+            except StopIteration:
+                break
+            result = await self._ask_async(query)
+        await self.drain()
+
+__all__ = [
+    "AsyncSerialPort",
+    "AsyncTerminal",
+]
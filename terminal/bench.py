@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module benchmarks the hot paths over a pty, with an Emulator answering
+on the other side.  Run it with "python -m terminal.bench"; the
+results are written as JSON.
+
+ptys aren't paced, so these measure what we spend, not what the wire does.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import tty
+
+from .emulator import Emulator
+from .serial import SerialPort
+from .terminal import Terminal
+
+class _Counter():
+    """ A stand-in for a record.Recorder that just counts bytes """
+
+    def __init__(self):
+        self.sent_bytes = 0
+        self.received_bytes = 0
+
+    def sent(self, data):
+        """ count data as sent """
+        self.sent_bytes += len(data)
+
+    def received(self, data):
+        """ count data as received """
+        self.received_bytes += len(data)
+
+def _summary(samples):
+    """ Summarize a list of timings, in seconds """
+    return {
+        "n": len(samples),
+        "mean": statistics.mean(samples),
+        "median": statistics.median(samples),
+        "min": min(samples),
+        "max": max(samples),
+    }
+
+# passed to each Emulator; see main()
+_emulator_args = {}
+
+@contextlib.contextmanager
+def _terminal(**kwargs):
+    """ A Terminal on a pty with an Emulator on the other end, both shut
+    down again when the with block is done """
+    term = Terminal("bench", use_pty=True, **kwargs)
+    emulator = Emulator.attach(term, **_emulator_args).start()
+    try:
+        yield term
+    finally:
+        emulator.stop()
+        term.close()
+
+def bench_port(size: int = 1 << 22, block: int = 4096):
+    """ Raw SerialPort.write() and read() throughput, in bytes/second """
+    port = SerialPort("bench", use_pty=True)
+    # pylint: disable=protected-access
+    slave = port._slave_pty
+    tty.setraw(slave)
+    try:
+        return _bench_port(port, slave, size, block)
+    finally:
+        port.close()
+
+def _bench_port(port, slave, size, block):
+    """ bench_port() on an open port and its slave side """
+    chunk = b"x" * block
+
+    def sink():
+        left = size
+        while left > 0:
+            left -= len(os.read(slave, 65536))
+
+    reader = threading.Thread(target=sink)
+    reader.start()
+    start = time.perf_counter()
+    for _ in range(size // block):
+        port.write(chunk, timeout=5)
+    reader.join()
+    write_time = time.perf_counter() - start
+
+    def source():
+        for _ in range(size // block):
+            os.write(slave, chunk)
+
+    writer = threading.Thread(target=source)
+    start = time.perf_counter()
+    writer.start()
+    port.read(size // block * block, timeout=5)
+    read_time = time.perf_counter() - start
+    writer.join()
+
+    return {
+        "bytes": size // block * block,
+        "write_bytes_per_second": size / write_time,
+        "read_bytes_per_second": size / read_time,
+    }
+
+def bench_write(iterations: int = 200, trust_model: bool = True):
+    """ How long Terminal.write() takes, with or without asking where the
+    cursor is afterwards """
+    samples = []
+    with _terminal(trust_model=trust_model) as term:
+        for i in range(iterations):
+            term.gotoxy(1, 1 + i % term.max_y)
+            start = time.perf_counter()
+            term.write("x" * 40, limit=40)
+            samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+def bench_getpos(iterations: int = 200):
+    """ The getpos() round trip """
+    samples = []
+    with _terminal(trust_model=True) as term:
+        for _ in range(iterations):
+            start = time.perf_counter()
+            term.getpos()
+            samples.append(time.perf_counter() - start)
+    return _summary(samples)
+
+def bench_setup(fast_probe: bool = False):
+    """ How long setup() takes, how much it sends, and what it finds """
+    with _terminal(fast_probe=fast_probe) as term:
+        counter = _Counter()
+        term.recorder = counter
+        start = time.perf_counter()
+        term.setup()
+        return {
+            "seconds": time.perf_counter() - start,
+            "bytes_sent": counter.sent_bytes,
+            "bytes_received": counter.received_bytes,
+            "geometry": [term.min_x, term.min_y, term.max_x, term.max_y],
+        }
+
+def bench_repaint(iterations: int = 20):
+    """ Bytes sent and time taken to repaint the whole screen, and to
+    repaint it after changing one line """
+    with _terminal(trust_model=True) as term:
+        counter = _Counter()
+        term.recorder = counter
+        rand = random.Random(0)
+        letters = "abcdefghijklmnopqrstuvwxyz "
+        full = []
+        full_bytes = []
+        line = []
+        line_bytes = []
+        for _ in range(iterations):
+            for y in range(1, term.max_y + 1):
+                term.draw(1, y, "".join(rand.choice(letters)
+                                        for x in range(term.max_x)))
+            term.screen.invalidate()
+            counter.sent_bytes = 0
+            start = time.perf_counter()
+            term.refresh()
+            full.append(time.perf_counter() - start)
+            full_bytes.append(counter.sent_bytes)
+
+            y = rand.randint(1, term.max_y)
+            term.draw(1, y, "".join(rand.choice(letters)
+                                    for x in range(term.max_x)))
+            counter.sent_bytes = 0
+            start = time.perf_counter()
+            term.refresh()
+            line.append(time.perf_counter() - start)
+            line_bytes.append(counter.sent_bytes)
+        return {
+            "cells": term.max_x * term.max_y,
+            "full": _summary(full),
+            "full_bytes": statistics.mean(full_bytes),
+            "one_line": _summary(line),
+            "one_line_bytes": statistics.mean(line_bytes),
+        }
+
+def run(iterations: int = 200):
+    """ Run every benchmark, and return the results as a dict """
+    results = {
+        "port": bench_port(),
+        "write_trusted": bench_write(iterations, trust_model=True),
+        "write_checked": bench_write(iterations, trust_model=False),
+        "getpos": bench_getpos(iterations),
+        "setup": bench_setup(fast_probe=False),
+        "setup_fast_probe": bench_setup(fast_probe=True),
+        "repaint": bench_repaint(max(iterations // 10, 1)),
+    }
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "time": time.time(),
+        "emulator": dict(_emulator_args),
+        "results": results,
+    }
+
+def main(argv=None):
+    """ python -m terminal.bench [-n ITERATIONS] [-o FILE] """
+    args = argparse.ArgumentParser(prog="python -m terminal.bench",
+                                   description=__doc__)
+    args.add_argument("-n", "--iterations", type=int, default=200,
+                      help="samples per timing benchmark")
+    args.add_argument("-o", "--output", default="-",
+                      help="where to write the JSON results")
+    args.add_argument("-s", "--speed", type=int, default=None,
+                      help="line speed for the emulator to simulate")
+    args.add_argument("-d", "--delay", type=float, default=0.0,
+                      help="seconds the emulator takes per escape sequence")
+    args = args.parse_args(argv)
+    _emulator_args.update(speed=args.speed, delay=args.delay)
+
+    results = run(args.iterations)
+
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write("\n")
+    else:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+    return 0
+
+__all__ = [
+    "main",
+    "run",
+]
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,415 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module provides a VT100 emulator to sit on the other end of a pty, so
+Terminal can be driven, tested, and benchmarked without real hardware.
+"""
+import array
+import os
+import selectors
+import threading
+import time
+import tty
+
+from . import parser
+from .screen import A_NORMAL, A_BOLD, A_DIM, A_UNDERLINE, A_BLINK, \
+        A_REVERSE, A_INVISIBLE, _UTF32
+
+_SGR = {
+    1: (A_BOLD, 0),
+    2: (A_DIM, 0),
+    4: (A_UNDERLINE, 0),
+    5: (A_BLINK, 0),
+    7: (A_REVERSE, 0),
+    8: (A_INVISIBLE, 0),
+    22: (0, A_BOLD | A_DIM),
+    24: (0, A_UNDERLINE),
+    25: (0, A_BLINK),
+    27: (0, A_REVERSE),
+    28: (0, A_INVISIBLE),
+}
+
+class Emulator():
+    """ A VT100 (with a little VT102) on the slave side of a pty.
+
+    It keeps the screen in arrays of code points and attributes, follows
+    cursor movement, scrolling regions, autowrap, origin mode and tab
+    stops, and answers DSR 5, DSR 6 (CPR), DA, and ENQ.
+
+    speed simulates a serial line: we take bytes no faster than speed
+    baud allows, so the host's writes back up in the pty the way they
+    would on a real port.  delay is how long each escape sequence takes
+    to carry out, for terminals that are slow about it.
+
+    feed() runs bytes through the emulator directly; start() runs it on
+    a thread, reading from the pty.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    # when simulating a line speed, how much time's worth of bytes we
+    # take in at once
+    tick = 0.005
+
+    def __init__(self, path, width: int = 80, height: int = 24,
+                 speed: int = None, delay: float = 0.0,
+                 answerback: bytes = b""):
+        """ path: the pty slave to attach to, usually Terminal.pty_path """
+        self.path = path
+        self.width = width
+        self.height = height
+        self.speed = speed
+        self.delay = delay
+        self.answerback = answerback
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY)
+        tty.setraw(self.fd)
+        self.parser = parser.Parser()
+        self.bells = 0
+        self._thread = None
+        self._stopping = False
+        self.reset()
+
+    @classmethod
+    def attach(cls, port, **kwargs):
+        """ Make an Emulator on the slave side of port, which must be a
+        pty """
+        if not port.pty:
+            raise ValueError("%s is not a pty" % (port.name,))
+        return cls(port.pty_path, **kwargs)
+
+    def reset(self):
+        """ Go back to the power-on state, as RIS does """
+        self._chars = [self._blank_chars() for y in range(self.height)]
+        self._attrs = [self._blank_attrs() for y in range(self.height)]
+        self.x = 1
+        self.y = 1
+        self.attrs = A_NORMAL
+        self.wrap_pending = False
+        self.autowrap = True
+        self.origin_mode = False
+        self.newline_mode = False
+        self.top = 1
+        self.bottom = self.height
+        self.saved = (1, 1, A_NORMAL, False)
+        self.tabs = array.array('B', [0]) * self.width
+        for x in range(8, self.width, 8):
+            self.tabs[x] = 1
+
+    def _blank_chars(self):
+        return array.array('I', [ord(' ')]) * self.width
+
+    def _blank_attrs(self):
+        return array.array('B', [A_NORMAL]) * self.width
+
+    def text(self, y: int):
+        """ The text on line y """
+        return self._chars[y - 1].tobytes().decode(_UTF32)
+
+    def lines(self):
+        """ All the text on the screen, a line at a time """
+        return [self.text(y) for y in range(1, self.height + 1)]
+
+    def get(self, x: int, y: int):
+        """ Get the (character, attributes) at (x, y) """
+        return (chr(self._chars[y - 1][x - 1]), self._attrs[y - 1][x - 1])
+
+    def start(self):
+        """ Start reading from the pty on a thread of our own """
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="emulator %s" % (self.path,))
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop the thread and let go of the pty """
+        self._stopping = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        os.close(self.fd)
+
+    def _run(self):
+        """ The emulator thread """
+        selector = selectors.DefaultSelector()
+        selector.register(self.fd, selectors.EVENT_READ)
+        busy_until = time.monotonic()
+        while not self._stopping:
+            if not selector.select(0.1):
+                continue
+            size = 65536
+            if self.speed:
+                size = max(int(self.speed / 10 * self.tick), 1)
+            try:
+                data = os.read(self.fd, size)
+            except OSError:
+                break
+            if not data:
+                break
+            reply, sequences = self._feed(data)
+            if reply:
+                os.write(self.fd, reply)
+
+            busy = sequences * self.delay
+            if self.speed:
+                busy += len(data) * 10 / self.speed
+            if busy:
+                busy_until = max(busy_until, time.monotonic()) + busy
+                wait = busy_until - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+        selector.close()
+
+    def feed(self, data):
+        """ Act on data as though the host sent it, and return what we'd
+        send back """
+        return self._feed(data)[0]
+
+    def _feed(self, data):
+        """ feed(), but also say how many escape sequences there were """
+        reply = bytearray()
+        sequences = 0
+        for event in self.parser.feed(data):
+            if isinstance(event, parser.Text):
+                self._text(event.text)
+                continue
+            answer = None
+            if isinstance(event, parser.Control):
+                answer = self._control(event.char)
+            elif isinstance(event, parser.CSI):
+                sequences += 1
+                answer = self._csi(event)
+            elif isinstance(event, parser.Escape):
+                sequences += 1
+                self._escape(event)
+            if answer:
+                reply += answer
+        return (bytes(reply), sequences)
+
+    def _goto(self, x, y):
+        """ Move to (x, y), clamped to the screen """
+        self.x = min(max(x, 1), self.width)
+        self.y = min(max(y, 1), self.height)
+        self.wrap_pending = False
+
+    def _scroll_up(self):
+        """ Scroll the scrolling region up a line """
+        for rows, blank in ((self._chars, self._blank_chars),
+                            (self._attrs, self._blank_attrs)):
+            del rows[self.top - 1]
+            rows.insert(self.bottom - 1, blank())
+
+    def _scroll_down(self):
+        """ Scroll the scrolling region down a line """
+        for rows, blank in ((self._chars, self._blank_chars),
+                            (self._attrs, self._blank_attrs)):
+            del rows[self.bottom - 1]
+            rows.insert(self.top - 1, blank())
+
+    def _index(self):
+        """ Move down a line, scrolling at the bottom margin """
+        if self.y == self.bottom:
+            self._scroll_up()
+        elif self.y < self.height:
+            self.y += 1
+        self.wrap_pending = False
+
+    def _reverse_index(self):
+        """ Move up a line, scrolling at the top margin """
+        if self.y == self.top:
+            self._scroll_down()
+        elif self.y > 1:
+            self.y -= 1
+        self.wrap_pending = False
+
+    def _text(self, text):
+        """ Print text at the cursor """
+        while text:
+            if self.wrap_pending:
+                self.x = 1
+                self._index()
+            room = self.width - self.x + 1
+            run = text[:room]
+            text = text[room:]
+            if text and not self.autowrap:
+                # everything past the margin lands on the last column
+                run = run[:-1] + text[-1]
+                text = ""
+            start = self.x - 1
+            end = start + len(run)
+            self._chars[self.y - 1][start:end] = \
+                    array.array('I', run.encode(_UTF32))
+            self._attrs[self.y - 1][start:end] = \
+                    array.array('B', [self.attrs]) * len(run)
+            self.x += len(run)
+            if self.x > self.width:
+                self.x = self.width
+                self.wrap_pending = self.autowrap
+
+    def _control(self, char):
+        """ Carry out a control character """
+        if char == '\r':
+            self._goto(1, self.y)
+        elif char in '\n\x0b\x0c':
+            if self.newline_mode:
+                self.x = 1
+            self._index()
+        elif char == '\b':
+            self._goto(self.x - 1, self.y)
+        elif char == '\t':
+            x = self.x
+            while x < self.width and not self.tabs[x]:
+                x += 1
+            self._goto(x + 1, self.y)
+        elif char == '\x05':
+            return self.answerback
+        elif char == '\x07':
+            self.bells += 1
+        return None
+
+    def _escape(self, event):
+        """ Carry out ESC intermediates final; none of these answer """
+        if event.intermediates == '#' and event.final == '8':
+            # DECALN
+            for y in range(self.height):
+                self._chars[y][:] = array.array('I', [ord('E')]) * self.width
+                self._attrs[y][:] = self._blank_attrs()
+            self._goto(1, 1)
+        elif event.intermediates:
+            # character set selection and such
+            pass
+        elif event.final == 'c':
+            self.reset()
+        elif event.final == 'D':
+            self._index()
+        elif event.final == 'E':
+            self.x = 1
+            self._index()
+        elif event.final == 'M':
+            self._reverse_index()
+        elif event.final == 'H':
+            self.tabs[self.x - 1] = 1
+        elif event.final == '7':
+            self.saved = (self.x, self.y, self.attrs, self.origin_mode)
+        elif event.final == '8':
+            x, y, self.attrs, self.origin_mode = self.saved
+            self._goto(x, y)
+
+    def _home(self):
+        """ Go to the top left, which is in the scrolling region when
+        origin mode is on """
+        self._goto(1, self.top if self.origin_mode else 1)
+
+    def _erase(self, y, start, end):
+        """ Blank columns start..end-1 of line y """
+        self._chars[y - 1][start - 1:end - 1] = \
+                array.array('I', [ord(' ')]) * (end - start)
+        self._attrs[y - 1][start - 1:end - 1] = \
+                array.array('B', [A_NORMAL]) * (end - start)
+
+    def _csi(self, event):
+        """ Carry out a CSI sequence, and return our answer if it's a
+        question """
+        # pylint: disable=too-many-branches,too-many-statements
+        if event.intermediates:
+            return None
+        params = event.params
+        final = event.final
+        p0 = params[0] if params and params[0] else 0
+        n = p0 or 1
+
+        if event.private == '?':
+            if final in 'hl':
+                for mode in params:
+                    if mode == 6:
+                        self.origin_mode = final == 'h'
+                        self._home()
+                    elif mode == 7:
+                        self.autowrap = final == 'h'
+            return None
+        if event.private:
+            return None
+
+        if final == 'A':
+            top = self.top if self.y >= self.top else 1
+            self._goto(self.x, max(self.y - n, top))
+        elif final == 'B':
+            bottom = self.bottom if self.y <= self.bottom else self.height
+            self._goto(self.x, min(self.y + n, bottom))
+        elif final == 'C':
+            self._goto(self.x + n, self.y)
+        elif final == 'D':
+            self._goto(self.x - n, self.y)
+        elif final in 'Hf':
+            y = n
+            x = params[1] if len(params) > 1 and params[1] else 1
+            if self.origin_mode:
+                self._goto(x, min(y + self.top - 1, self.bottom))
+            else:
+                self._goto(x, y)
+        elif final == 'J':
+            if p0 == 0:
+                self._erase(self.y, self.x, self.width + 1)
+                lines = range(self.y + 1, self.height + 1)
+            elif p0 == 1:
+                self._erase(self.y, 1, self.x + 1)
+                lines = range(1, self.y)
+            else:
+                lines = range(1, self.height + 1)
+            for y in lines:
+                self._erase(y, 1, self.width + 1)
+        elif final == 'K':
+            if p0 == 0:
+                self._erase(self.y, self.x, self.width + 1)
+            elif p0 == 1:
+                self._erase(self.y, 1, self.x + 1)
+            else:
+                self._erase(self.y, 1, self.width + 1)
+        elif final == 'm':
+            for param in params or (0,):
+                if not param:
+                    self.attrs = A_NORMAL
+                elif param in _SGR:
+                    on, off = _SGR[param]
+                    self.attrs = (self.attrs & ~off) | on
+        elif final == 'n':
+            if p0 == 5:
+                return b"\x1b[0n"
+            if p0 == 6:
+                y = self.y
+                if self.origin_mode:
+                    y -= self.top - 1
+                return b"\x1b[%d;%dR" % (y, self.x)
+        elif final == 'c':
+            if p0 == 0:
+                return b"\x1b[?1;2c"
+        elif final in 'hl':
+            if 20 in params:
+                self.newline_mode = final == 'h'
+        elif final == 'r':
+            top = p0 or 1
+            bottom = params[1] if len(params) > 1 and params[1] \
+                    else self.height
+            if top < bottom <= self.height:
+                self.top = top
+                self.bottom = bottom
+                self._home()
+        elif final == 'g':
+            if p0 == 0:
+                self.tabs[self.x - 1] = 0
+            elif p0 == 3:
+                self.tabs[:] = array.array('B', [0]) * self.width
+        elif final == 's':
+            self.saved = (self.x, self.y, self.attrs, self.origin_mode)
+        elif final == 'u':
+            x, y, self.attrs, self.origin_mode = self.saved
+            self._goto(x, y)
+        return None
+
+__all__ = [
+    "Emulator",
+]
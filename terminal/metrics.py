@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module keeps counters and timings for the hot paths, and hands out
+trace events to whoever wants them.
+"""
+import collections
+import contextlib
+import sys
+import time
+
+class Metrics():
+    """ Counters, timers, and latency histograms, all keyed by name.
+
+    Counting is a dict update, so it's cheap enough to leave on.  Trace
+    events cost nothing until a tracer is set: tracer(event, fields) gets
+    called with the event's name and a dict of what it's about.  Setting
+    exporter lets export() hand a snapshot to a metrics system.
+
+    Every port uses default_metrics unless it's given its own.
+    """
+
+    # histogram buckets are powers of two microseconds, up to about 35
+    # minutes; bucket i counts times below 2**i us.
+    buckets = 32
+
+    def __init__(self, tracer=None, exporter=None):
+        self.tracer = tracer
+        self.exporter = exporter
+        self._counters = collections.Counter()
+        # name: [count, total, max]
+        self._timers = {}
+        self._histograms = {}
+
+    def count(self, name, n: int = 1):
+        """ Add n to the counter called name """
+        self._counters[name] += n
+
+    def time(self, name, seconds: float):
+        """ Record that something called name took seconds """
+        timer = self._timers.get(name)
+        if timer is None:
+            timer = self._timers[name] = [0, 0.0, 0.0]
+            self._histograms[name] = [0] * self.buckets
+        timer[0] += 1
+        timer[1] += seconds
+        if seconds > timer[2]:
+            timer[2] = seconds
+        bucket = min(int(seconds * 1000000).bit_length(), self.buckets - 1)
+        self._histograms[name][bucket] += 1
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        """ Time the with block as name """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.time(name, time.monotonic() - start)
+
+    def trace(self, event, **fields):
+        """ Send a trace event to the tracer, if there is one """
+        if self.tracer is not None:
+            self.tracer(event, fields)
+
+    def snapshot(self):
+        """ Everything so far, as a dict of plain values """
+        timers = {}
+        for name, (count, total, longest) in self._timers.items():
+            histogram = self._histograms[name]
+            timers[name] = {
+                "count": count,
+                "total": total,
+                "mean": total / count,
+                "max": longest,
+                # "<2**i us": n, leaving out empty buckets
+                "histogram": {"<%dus" % (1 << i,): n
+                              for i, n in enumerate(histogram) if n},
+            }
+        return {
+            "counters": dict(self._counters),
+            "timers": timers,
+        }
+
+    def reset(self):
+        """ Start over from zero """
+        self._counters.clear()
+        self._timers.clear()
+        self._histograms.clear()
+
+    def export(self, reset: bool = False):
+        """ Hand a snapshot to the exporter, if there is one, and return
+        it; with reset, start over afterwards. """
+        snapshot = self.snapshot()
+        if self.exporter is not None:
+            self.exporter(snapshot)
+        if reset:
+            self.reset()
+        return snapshot
+
+def print_tracer(event, fields):
+    """ A tracer that prints each event to stderr """
+    print("%s: %s" % (event, ", ".join("%s=%r" % item
+                                      for item in sorted(fields.items()))),
+          file=sys.stderr)
+
+default_metrics = Metrics()
+
+__all__ = [
+    "Metrics",
+    "default_metrics",
+    "print_tracer",
+]
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module figures out the cheapest way to move the cursor, in the spirit
+of ncurses' mvcur().  Moves are planned as bytes, from the cached encoders
+in sequences, so they're ready to send.
+"""
+
+import functools
+
+from . import sequences
+
+@functools.lru_cache(maxsize=1024)
+def _csi_count(n: int, final: str):
+    """ CSI Pn final, leaving out Pn when it's the default of 1 """
+    if n == 1:
+        return sequences.escape("[" + final)
+    return sequences.csi_n(n, final)
+
+@functools.lru_cache(maxsize=4096)
+def cup_sequence(x: int, y: int):
+    """ The shortest CUP that goes to (x, y) """
+    if x == 1:
+        if y == 1:
+            return sequences.CUP_HOME
+        return sequences.csi_n(y, 'H')
+    return sequences.position(x, y)
+
+class MovePlanner():
+    """ Pick the cheapest of an absolute move, relative moves (CUU, CUD,
+    CUF, CUB), CR, LF, BS, and reprinting the cells we know are already
+    under the cursor's path.
+
+    Costs are in seconds: each byte costs byte_time on the wire, and
+    an absolute move also costs cup_delay of pacing afterwards.
+    """
+
+    def __init__(self, byte_time: float = 10 / 19200, cup_delay: float = 0.0):
+        self.byte_time = byte_time
+        self.cup_delay = cup_delay
+
+    def cost(self, seq: bytes, delay: float = 0.0):
+        """ what it costs to send seq and then wait for delay """
+        return len(seq) * self.byte_time + delay
+
+    @staticmethod
+    def vertical(y0: int, y1: int, lf_ok: bool = True):
+        """ The shortest relative move from line y0 to line y1 """
+        if y1 > y0:
+            n = y1 - y0
+            seq = _csi_count(n, 'B')
+            if lf_ok and n <= len(seq):
+                seq = b"\n" * n
+            return seq
+        if y1 < y0:
+            return _csi_count(y0 - y1, 'A')
+        return b""
+
+    @staticmethod
+    def horizontal(x0: int, x1: int, known=None):
+        """ The shortest relative move from column x0 to column x1.
+        known(start, end) should give the text already on the screen at
+        columns start..end-1 of the destination line if reprinting it
+        would leave the screen unchanged, or None. """
+        if x1 == x0:
+            return b""
+
+        def forward(start):
+            seq = _csi_count(x1 - start, 'C')
+            if known is not None:
+                text = known(start, x1)
+                if text is not None:
+                    text = text.encode('utf-8')
+                    if len(text) < len(seq):
+                        seq = text
+            return seq
+
+        if x1 > x0:
+            options = [forward(x0)]
+        else:
+            options = [_csi_count(x0 - x1, 'D'), b"\b" * (x0 - x1)]
+        if x1 == 1:
+            options.append(b"\r")
+        elif x1 < x0:
+            options.append(b"\r" + forward(1))
+        return min(options, key=len)
+
+    def plan(self, x0: int, y0: int, x1: int, y1: int, known=None,
+             lf_ok: bool = True, relative_ok: bool = True,
+             wrap_pending: bool = False):
+        """ Get (sequence, cost, absolute) for moving from (x0, y0) to
+        (x1, y1); absolute is True when the answer is a CUP, which needs
+        its pacing delay afterwards.  Without relative_ok, say because the
+        move leaves the scrolling region, it's always a CUP.  Without
+        lf_ok, say because the tty turns LF into CR LF, we don't use LF.
+        With wrap_pending, the cursor is in the last column waiting to
+        wrap, so a relative move starts with a CR to cancel that. """
+        # pylint: disable=too-many-arguments
+        absolute = cup_sequence(x1, y1)
+        absolute_cost = self.cost(absolute, self.cup_delay)
+        if not relative_ok:
+            return (absolute, absolute_cost, True)
+
+        if wrap_pending:
+            relative = b"\r" + self.vertical(y0, y1, lf_ok) + \
+                    self.horizontal(1, x1, known)
+        else:
+            relative = self.vertical(y0, y1, lf_ok) + \
+                    self.horizontal(x0, x1, known)
+        relative_cost = self.cost(relative)
+        if relative_cost < absolute_cost:
+            return (relative, relative_cost, False)
+        return (absolute, absolute_cost, True)
+
+__all__ = [
+    "MovePlanner",
+    "cup_sequence",
+]
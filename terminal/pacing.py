@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module keeps track of when a terminal can take more output.
+"""
+import time
+
+class Pacer():
+    """ Tracks the bytes we've sent down a port and the delays the terminal
+    needs after some of them, so we only wait when the next write would
+    actually land inside one of those delays.
+
+    A delay of n is n * fudge / speed seconds, which is what fill() has
+    always slept for, and it starts once the bytes before it are on the
+    wire rather than when we handed them to the kernel.
+
+    Normally when that happens is an estimate from the baud rate.  If the
+    port's sync_output is set, we ask the kernel how much is really left
+    in its output queue instead, and since that's not a guess, the fudge
+    factor goes away too.
+    """
+
+    # bits on the wire per character: start, 8 data, stop
+    bits_per_char = 10
+
+    def __init__(self, port, fudge: float = 1.2):
+        self.port = port
+        # nerf it up /just a little/
+        self.fudge = fudge
+        # when the last byte we've written will have been sent
+        self._tx_done = 0.0
+        # when the terminal will be ready for the next byte
+        self._ready_at = 0.0
+
+    @property
+    def enabled(self):
+        """ ptys don't need pacing """
+        return not self.port.pty
+
+    def _speed(self):
+        """ the port's real output speed; get_speed() reads it from the
+        kernel the first time and caches it after that """
+        return self.port.get_speed()
+
+    def char_time(self):
+        """ how long one character takes on the wire """
+        return self.bits_per_char / self._speed()
+
+    def delay_time(self, n):
+        """ how long a delay of n is, in seconds """
+        if not self.enabled:
+            return 0.0
+        if self.port.sync_output:
+            return n / self._speed()
+        return (n * self.fudge) / self._speed()
+
+    def _queue_done(self):
+        """ when the kernel's output queue will be empty, going by
+        TIOCOUTQ """
+        return time.monotonic() + \
+                self.port.output_pending() * self.char_time()
+
+    def sent(self, nbytes: int):
+        """ Note that we've just written nbytes """
+        if not self.enabled:
+            return
+        if self.port.sync_output:
+            self._tx_done = self._queue_done()
+            return
+        now = time.monotonic()
+        self._tx_done = max(now, self._tx_done) + nbytes * self.char_time()
+
+    def delay(self, n):
+        """ The terminal needs a delay of n after what we've sent so far """
+        if not self.enabled:
+            return
+        if self.port.sync_output:
+            start = self._tx_done = self._queue_done()
+        else:
+            start = max(time.monotonic(), self._tx_done)
+        self._ready_at = max(self._ready_at, start + self.delay_time(n))
+
+    def in_flight(self):
+        """ roughly how many bytes are still on their way out """
+        if self.enabled and self.port.sync_output:
+            return self.port.output_pending()
+        left = self._tx_done - time.monotonic()
+        if left <= 0:
+            return 0
+        return int(left / self.char_time())
+
+    def done_at(self):
+        """ the monotonic time at which everything we've sent will have
+        reached the terminal, and any delay it needs after it is over """
+        if self.enabled and self.port.sync_output:
+            tx_done = self._queue_done()
+        else:
+            tx_done = self._tx_done
+        return max(tx_done, self._ready_at)
+
+    def ready_at(self):
+        """ the monotonic time at which we can write again """
+        return self._ready_at
+
+    def wait_time(self):
+        """ how long until we can write again """
+        return max(self._ready_at - time.monotonic(), 0.0)
+
+    def ready(self):
+        """ can we write right now? """
+        return self.wait_time() == 0.0
+
+    def wait(self):
+        """ Sleep until we can write again """
+        t = self.wait_time()
+        if t > 0:
+            time.sleep(t)
+            self.port.metrics.time("pacing.sleep", t)
+
+__all__ = [
+    "Pacer",
+]
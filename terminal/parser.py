@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module turns a stream of bytes from (or to) a vt100 style terminal into
+events: runs of text, control characters, and escape sequences.
+"""
+import codecs
+import collections
+import re
+
+Text = collections.namedtuple("Text", ["text"])
+Control = collections.namedtuple("Control", ["char"])
+Escape = collections.namedtuple("Escape", ["intermediates", "final"])
+CSI = collections.namedtuple("CSI", ["private", "params", "intermediates",
+                                     "final"])
+SS3 = collections.namedtuple("SS3", ["final"])
+
+# What the terminal sends back to the host
+CPR = collections.namedtuple("CPR", ["x", "y"])
+DA = collections.namedtuple("DA", ["options"])
+DSR = collections.namedtuple("DSR", ["status"])
+Key = collections.namedtuple("Key", ["name"])
+
+# anything that isn't printable text
+_CONTROL_RE = re.compile(b"[\x00-\x1f\x7f]")
+# ESC [ private/params intermediates final
+_CSI_RE = re.compile(b"\x1b\\[([\x30-\x3f]*)([\x20-\x2f]*)([\x40-\x7e])")
+# ESC intermediates final, which is everything but CSI and SS3
+_ESC_RE = re.compile(b"\x1b([\x20-\x2f]*)([\x30-\x7e])")
+# ESC O final
+_SS3_RE = re.compile(b"\x1bO([\x20-\x7e])")
+# the start of a sequence we can't finish until more bytes show up
+_PARTIAL_RE = re.compile(b"\x1b(\\[[\x20-\x3f]*|O|[\x20-\x2f]*)")
+
+_CSI_KEYS = {
+    'A': "up",
+    'B': "down",
+    'C': "right",
+    'D': "left",
+    'H': "home",
+    'F': "end",
+}
+
+_SS3_KEYS = {
+    'A': "up",
+    'B': "down",
+    'C': "right",
+    'D': "left",
+    'P': "F1",
+    'Q': "F2",
+    'R': "F3",
+    'S': "F4",
+    'M': "kp_enter",
+    'l': "kp_comma",
+    'm': "kp_minus",
+    'n': "kp_period",
+    'p': "kp_0",
+    'q': "kp_1",
+    'r': "kp_2",
+    's': "kp_3",
+    't': "kp_4",
+    'u': "kp_5",
+    'v': "kp_6",
+    'w': "kp_7",
+    'x': "kp_8",
+    'y': "kp_9",
+}
+
+# CSI Pn ~
+_TILDE_KEYS = {
+    1: "home",
+    2: "insert",
+    3: "delete",
+    4: "end",
+    5: "page_up",
+    6: "page_down",
+    15: "F5",
+    17: "F6",
+    18: "F7",
+    19: "F8",
+    20: "F9",
+    21: "F10",
+    23: "F11",
+    24: "F12",
+}
+
+def _params(raw: str):
+    """ Split "1;;3" into (1, None, 3); missing parameters are None """
+    if not raw:
+        return ()
+    return tuple(int(p) if p.isdigit() else None for p in raw.split(';'))
+
+class Parser():
+    """ An incremental parser for ESC, CSI and SS3 sequences.  Feed it
+    chunks of any size; sequences split across chunks are held until they
+    are complete. """
+
+    def __init__(self):
+        self._pending = b""
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def reset(self):
+        """ Forget any partial sequence or character """
+        self._pending = b""
+        self._decoder.reset()
+
+    def _csi(self, private, params, intermediates, final):
+        """ make an event for a CSI sequence """
+        # pylint: disable=no-self-use
+        return CSI(private, params, intermediates, final)
+
+    def _ss3(self, final):
+        """ make an event for an SS3 sequence """
+        # pylint: disable=no-self-use
+        return SS3(final)
+
+    def feed(self, data):
+        """ Parse data, returning a list of the events it completes """
+        # pylint: disable=too-many-branches
+        if self._pending:
+            data = self._pending + bytes(data)
+            self._pending = b""
+        events = []
+        pos = 0
+        end = len(data)
+
+        while pos < end:
+            match = _CONTROL_RE.search(data, pos)
+            if match is None:
+                text = self._decoder.decode(data[pos:])
+                if text:
+                    events.append(Text(text))
+                break
+            start = match.start()
+            if start > pos:
+                text = self._decoder.decode(data[pos:start])
+                if text:
+                    events.append(Text(text))
+            pos = start
+
+            if data[pos] != 0x1b:
+                events.append(Control(chr(data[pos])))
+                pos += 1
+                continue
+
+            match = _CSI_RE.match(data, pos)
+            if match:
+                raw, intermediates, final = \
+                        (g.decode('ascii') for g in match.groups())
+                private = ""
+                if raw and raw[0] in "<=>?":
+                    private = raw[0]
+                    raw = raw[1:]
+                events.append(self._csi(private, _params(raw),
+                                        intermediates, final))
+                pos = match.end()
+                continue
+
+            match = _SS3_RE.match(data, pos)
+            if match:
+                events.append(self._ss3(match.group(1).decode('ascii')))
+                pos = match.end()
+                continue
+
+            if _PARTIAL_RE.fullmatch(data, pos):
+                self._pending = bytes(data[pos:])
+                break
+
+            match = _ESC_RE.match(data, pos)
+            if match:
+                intermediates, final = \
+                        (g.decode('ascii') for g in match.groups())
+                events.append(Escape(intermediates, final))
+                pos = match.end()
+                continue
+
+            # not a sequence we know how to read; pass the ESC along and
+            # start over with whatever comes after it.
+            events.append(Control('\x1b'))
+            pos += 1
+
+        return events
+
+class InputParser(Parser):
+    """ A Parser for what a terminal sends the host, which turns reports and
+    keys into CPR, DA, DSR and Key events. """
+
+    def _csi(self, private, params, intermediates, final):
+        if not intermediates:
+            if final == 'R' and private in ("", "?"):
+                y = params[0] if params and params[0] else 1
+                x = params[1] if len(params) > 1 and params[1] else 1
+                return CPR(x, y)
+            if final == 'c' and private == '?':
+                return DA(params)
+            if final == 'n' and not private:
+                return DSR(params[0] if params and params[0] else 0)
+            if final in _CSI_KEYS and not private:
+                return Key(_CSI_KEYS[final])
+            if final == '~' and params and params[0] in _TILDE_KEYS:
+                return Key(_TILDE_KEYS[params[0]])
+        return Parser._csi(self, private, params, intermediates, final)
+
+    def _ss3(self, final):
+        if final in _SS3_KEYS:
+            return Key(_SS3_KEYS[final])
+        return Parser._ss3(self, final)
+
+__all__ = [
+    "Parser",
+    "InputParser",
+    "Text",
+    "Control",
+    "Escape",
+    "CSI",
+    "SS3",
+    "CPR",
+    "DA",
+    "DSR",
+    "Key",
+]
@@ -0,0 +1,187 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module drives many terminals at once from one thread.
+"""
+import selectors
+import time
+
+from .terminal import QueuedTerminal
+
+class TerminalPool():
+    """ A set of QueuedTerminals sharing one selector.
+
+    Each terminal keeps its own Pacer, so a terminal waiting out a long
+    delay doesn't hold up the others; run() sends to whichever terminals
+    are ready and sleeps until the next one will be.  Setting up fifty
+    terminals takes about as long as setting up the slowest of them.
+    """
+
+    def __init__(self, selector=None):
+        if selector is None:
+            selector = selectors.EpollSelector()
+        self.selector = selector
+        self.terminals = []
+
+    def __iter__(self):
+        return iter(self.terminals)
+
+    def __len__(self):
+        return len(self.terminals)
+
+    def open(self, name, use_pty=False, **kwargs):
+        """ Make a QueuedTerminal on our selector and add it to the pool.
+        kwargs go to QueuedTerminal. """
+        terminal = QueuedTerminal(name, use_pty, selector=self.selector,
+                                  **kwargs)
+        self.terminals.append(terminal)
+        return terminal
+
+    def _send_queued(self):
+        """ Send what each terminal is ready for.  Returns (busy, wait):
+        whether anything is still queued, and how long until some
+        terminal's pacing lets it send more, or None. """
+        busy = False
+        wait = None
+        for terminal in self.terminals:
+            # pylint: disable=protected-access
+            if terminal.send_ready():
+                terminal._want(selectors.EVENT_READ)
+                continue
+            busy = True
+            left = terminal.pacer.wait_time()
+            if left > 0:
+                terminal._want(selectors.EVENT_READ)
+                wait = left if wait is None else min(wait, left)
+            else:
+                # the kernel's buffer is full
+                terminal._want(selectors.EVENT_READ | selectors.EVENT_WRITE)
+        return (busy, wait)
+
+    @staticmethod
+    def _step(tasks, results, terminal, steps, answer):
+        """ Give steps its answer, and note the next query it's waiting
+        on, or its result if it's finished """
+        try:
+            query = steps.send(answer)
+        except StopIteration as stop:
+            del tasks[terminal]
+            results[terminal] = stop.value
+            return
+        # [steps, query, when we last heard from the terminal]
+        tasks[terminal] = [steps, query, None]
+
+    def _advance(self, tasks, results):
+        """ Move along every task whose query has been answered, and ask
+        again for the ones that have waited too long.  Returns (moved,
+        wait): whether anything moved, and how long until the next task
+        gives up waiting, or None. """
+        # pylint: disable=protected-access
+        moved = False
+        wait = None
+        now = time.monotonic()
+        for terminal, task in list(tasks.items()):
+            steps, query, since = task
+            if query.event is not None:
+                self._step(tasks, results, terminal, steps, query._value())
+                moved = True
+                continue
+            if query.error is None:
+                if terminal.queued:
+                    # the clock doesn't start until the question is out
+                    task[2] = None
+                    continue
+                if since is None:
+                    # nor until it has reached the terminal
+                    since = task[2] = max(now, terminal.pacer.done_at())
+                left = since + 4 * terminal._get_timeout() - now
+                if left > 0:
+                    wait = left if wait is None else min(wait, left)
+                    continue
+            terminal._query_timed_out(query)
+            # like drain(), but without waiting for it to go quiet
+            terminal._forget_input()
+            moved = True
+            if query.once:
+                self._step(tasks, results, terminal, steps, None)
+                continue
+            task[1] = query.retry()
+            task[2] = None
+        return (moved, wait)
+
+    def _read(self, tasks, wait):
+        """ Wait up to wait for input, and parse whatever shows up """
+        # pylint: disable=protected-access
+        for key, mask in self.selector.select(wait):
+            terminal = key.data
+            if not mask & selectors.EVENT_READ or \
+                    terminal not in self.terminals:
+                continue
+            if terminal._read_available():
+                terminal._dispatch(terminal.parser.feed(
+                    terminal._take_input()))
+                if terminal in tasks:
+                    tasks[terminal][2] = time.monotonic()
+
+    def run(self, tasks=None):
+        """ Send everything the terminals have queued, and run tasks to
+        completion.
+
+        tasks maps a terminal to a generator that, like
+        Terminal._setup_steps(), yields a Query whenever it needs an answer
+        and is sent back the answer.  Returns a dict of what each generator
+        returned.
+        """
+        results = {}
+        waiting = {}
+        for terminal, steps in (tasks or {}).items():
+            self._step(waiting, results, terminal, steps, None)
+
+        while True:
+            busy, wait = self._send_queued()
+            moved, patience = self._advance(waiting, results)
+            if moved:
+                continue
+            if not busy and not waiting:
+                return results
+            if patience is not None:
+                wait = patience if wait is None else min(wait, patience)
+            self._read(waiting, wait)
+
+    def setup_all(self):
+        """ setup() every terminal in the pool at once """
+        # pylint: disable=protected-access
+        self.run({terminal: terminal._setup_steps()
+                  for terminal in self.terminals})
+
+    def ask_all(self, method, *args, **kwargs):
+        """ Call a query method, like query_position(), on every terminal
+        and wait for all the answers.  Returns them in pool order. """
+        def ask(terminal):
+            return (yield getattr(terminal, method)(*args, **kwargs))
+
+        results = self.run({terminal: ask(terminal)
+                            for terminal in self.terminals})
+        return [results[terminal] for terminal in self.terminals]
+
+    def broadcast(self, method, *args, **kwargs):
+        """ Call method on every terminal, then send all their output.
+        method is either the name of a Terminal method or a function to
+        call with the terminal as its first argument.  Returns what each
+        call returned, in pool order. """
+        results = []
+        for terminal in self.terminals:
+            if callable(method):
+                results.append(method(terminal, *args, **kwargs))
+            else:
+                results.append(getattr(terminal, method)(*args, **kwargs))
+        self.run()
+        return results
+
+__all__ = [
+    "TerminalPool",
+]
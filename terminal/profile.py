@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module remembers what setup() measured about a terminal, so the next
+setup() on the same one can skip measuring it again.
+"""
+import collections
+import json
+import os
+import tempfile
+
+# identity is ("da", the DA parameters) or ("answerback", the message)
+Profile = collections.namedtuple("Profile", ["min_x", "min_y", "max_x",
+                                             "max_y", "identity", "speed",
+                                             "round_trip"])
+
+class ProfileCache():
+    """ Terminal profiles kept in a JSON file, by the tty's path and then
+    by the terminal's identity: its DA answer, or failing that its
+    answerback message.  A profile measured at a different speed doesn't
+    count, since that can change what fits on a line.
+
+    By default the file is $XDG_CACHE_HOME/terminal/profiles.json.
+    """
+
+    version = 2
+
+    def __init__(self, path=None):
+        if path is None:
+            cache = os.environ.get("XDG_CACHE_HOME") or \
+                    os.path.join(os.path.expanduser("~"), ".cache")
+            path = os.path.join(cache, "terminal", "profiles.json")
+        self.path = path
+        self._profiles = None
+
+    @staticmethod
+    def _key(identity):
+        """ the key for a terminal's identity; the kind comes first, so an
+        answerback can't pass for a DA answer """
+        kind, value = identity
+        if kind == "da":
+            value = ";".join("" if p is None else str(p) for p in value)
+        return "%s %s" % (kind, value)
+
+    def _load(self):
+        """ read the cache file, if we haven't yet """
+        if self._profiles is not None:
+            return self._profiles
+        self._profiles = {}
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return self._profiles
+        if not isinstance(data, dict) or data.get("version") != self.version:
+            return self._profiles
+        for name, profiles in data.get("profiles", {}).items():
+            if not isinstance(profiles, dict):
+                continue
+            for fields in profiles.values():
+                try:
+                    kind, value = fields["identity"]
+                    if kind == "da":
+                        value = tuple(value)
+                    fields["identity"] = (kind, value)
+                    profile = Profile(**fields)
+                except (TypeError, KeyError, ValueError):
+                    continue
+                self._profiles.setdefault(name, {})[
+                    self._key(profile.identity)] = profile
+        return self._profiles
+
+    def _save(self):
+        """ write the cache file out, replacing the old one in one step """
+        data = {
+            "version": self.version,
+            "profiles": {name: {key: profile._asdict()
+                                for key, profile in profiles.items()}
+                         for name, profiles in self._profiles.items()},
+        }
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".profiles")
+            with os.fdopen(fd, "w") as f:
+                json.dump(data, f, indent=1, sort_keys=True)
+            os.replace(tmp, self.path)
+        except OSError:
+            # it's only a cache; the next setup() will just measure again.
+            pass
+
+    def lookup(self, name, identity, speed):
+        """ The Profile for the terminal on name with identity, or None if
+        we haven't got one for this speed """
+        profile = self._load().get(name, {}).get(self._key(identity))
+        if profile is None or profile.speed != speed:
+            return None
+        return profile
+
+    def store(self, name, profile):
+        """ Remember profile for the terminal on name """
+        self._load().setdefault(name, {})[self._key(profile.identity)] = \
+                profile
+        self._save()
+
+    def forget(self, name=None):
+        """ Forget the profiles for name, or all of them """
+        if name is None:
+            self._load().clear()
+        else:
+            self._load().pop(name, None)
+        self._save()
+
+__all__ = [
+    "Profile",
+    "ProfileCache",
+]
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module records what goes back and forth on a port, and plays it back.
+"""
+import os
+import struct
+import time
+
+from .serial import SerialPort
+
+MAGIC = b"TRMREC\x00\x01"
+# time.time(), direction, length; the data follows
+_RECORD = struct.Struct("<dBI")
+
+# host to terminal
+SENT = 0
+# terminal to host
+RECEIVED = 1
+
+class Recorder():
+    """ Appends what ports send and receive to a file, as timestamped
+    chunks.
+
+    The file starts with MAGIC, and each chunk after that is a "<dBI"
+    header (the time, SENT or RECEIVED, and the length) followed by the
+    bytes.  Recording to an existing recording adds to the end of it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a+b")
+        self._file.seek(0)
+        magic = self._file.read(len(MAGIC))
+        if not magic:
+            self._file.write(MAGIC)
+        elif magic != MAGIC:
+            self._file.close()
+            raise ValueError("%s is not a recording" % (path,))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def attach(self, port):
+        """ Start recording port's traffic """
+        port.recorder = self
+        return port
+
+    @staticmethod
+    def detach(port):
+        """ Stop recording port's traffic """
+        port.recorder = None
+
+    def record(self, direction, data):
+        """ Add a chunk going in direction """
+        # one write, so chunks from different threads can't interleave
+        self._file.write(_RECORD.pack(time.time(), direction, len(data)) +
+                         bytes(data))
+
+    def sent(self, data):
+        """ The port just sent data """
+        self.record(SENT, data)
+
+    def received(self, data):
+        """ The port just received data """
+        self.record(RECEIVED, data)
+
+    def flush(self):
+        """ Make sure everything so far is in the file """
+        self._file.flush()
+
+    def close(self):
+        """ Finish the recording """
+        self._file.close()
+
+def records(path):
+    """ Generate (time, direction, data) for each chunk in a recording """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a recording" % (path,))
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                return
+            when, direction, length = _RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                # the recorder was cut off in the middle of a chunk
+                return
+            yield (when, direction, data)
+
+class Replayer():
+    """ Plays a recording back into a port.
+
+    speed is how much faster than the original to go: 1.0 keeps the
+    original timing, 2.0 takes half as long, and None (or 0) doesn't wait
+    at all.
+    """
+
+    def __init__(self, path, speed: float = 1.0):
+        self.path = path
+        self.speed = speed
+
+    def replay(self, port, directions=(SENT,), timeout=None):
+        """ Play the chunks going in directions into port.  SENT chunks are
+        written to port, as though the host sent them again.  RECEIVED
+        chunks are written to the slave side of a pty port, as though the
+        terminal sent them.  Something needs to be reading the other side
+        as we go, or the pty will fill up.
+
+        Returns a dict of the bytes replayed in each direction, the number
+        of chunks, and how long it took. """
+        if RECEIVED in directions and not port.pty:
+            raise ValueError("can only replay what was received into a pty")
+
+        stats = {"sent": 0, "received": 0, "chunks": 0, "elapsed": 0.0}
+        start = time.monotonic()
+        first = None
+        for when, direction, data in records(self.path):
+            if direction not in directions:
+                continue
+            if self.speed:
+                if first is None:
+                    first = when
+                delay = start + (when - first) / self.speed - \
+                        time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+            if direction == SENT:
+                # the raw bytes, even if port is a Terminal, whose write()
+                # is for text
+                SerialPort.write(port, data, timeout)
+                stats["sent"] += len(data)
+            else:
+                # pylint: disable=protected-access
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(port._slave_pty, view):]
+                stats["received"] += len(data)
+            stats["chunks"] += 1
+
+        stats["elapsed"] = time.monotonic() - start
+        return stats
+
+__all__ = [
+    "MAGIC",
+    "SENT",
+    "RECEIVED",
+    "Recorder",
+    "Replayer",
+    "records",
+]
@@ -0,0 +1,155 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module provides a model of what is on a terminal's screen.
+"""
+import array
+import sys
+
+A_NORMAL = 0x00
+A_BOLD = 0x01
+A_DIM = 0x02
+A_UNDERLINE = 0x04
+A_BLINK = 0x08
+A_REVERSE = 0x10
+A_INVISIBLE = 0x20
+
+# array('u') is going away, so characters are stored as code points and
+# converted in bulk through UTF-32 in the machine's byte order.
+_UTF32 = "utf-32-le" if sys.byteorder == "little" else "utf-32-be"
+
+class Screen():
+    """ A grid of characters and attributes, plus a second grid holding
+    what we last sent to the terminal, so we can send just the difference.
+
+    Coordinates are 1-based, like everything else the terminal does.
+    """
+
+    # this many unchanged cells between two changed ones are cheaper to
+    # reprint than to move the cursor over.
+    merge_gap = 4
+
+    def __init__(self, width: int = 80, height: int = 24):
+        self.width = width
+        self.height = height
+
+        blank = array.array('I', [ord(' ')]) * width
+        normal = array.array('B', [A_NORMAL]) * width
+        self._chars = [array.array('I', blank) for y in range(height)]
+        self._attrs = [array.array('B', normal) for y in range(height)]
+        self._shown_chars = [array.array('I', blank) for y in range(height)]
+        self._shown_attrs = [array.array('B', normal) for y in range(height)]
+
+    def put(self, x: int, y: int, text: str, attrs: int = A_NORMAL):
+        """ Put text at (x, y), clipped to the edge of the screen """
+        if y < 1 or y > self.height or x > self.width:
+            return
+        if x < 1:
+            text = text[1 - x:]
+            x = 1
+        text = text[:self.width - x + 1]
+        if not text:
+            return
+
+        start = x - 1
+        end = start + len(text)
+        self._chars[y - 1][start:end] = array.array('I',
+                                                    text.encode(_UTF32))
+        self._attrs[y - 1][start:end] = array.array('B', [attrs]) * len(text)
+
+    def get(self, x: int, y: int):
+        """ Get the (character, attributes) at (x, y) """
+        return (chr(self._chars[y - 1][x - 1]), self._attrs[y - 1][x - 1])
+
+    def get_shown(self, x: int, y: int):
+        """ Get the (character, attributes) we last sent for (x, y) """
+        return (chr(self._shown_chars[y - 1][x - 1]),
+                self._shown_attrs[y - 1][x - 1])
+
+    def shown_text(self, start: int, end: int, y: int, attrs: int):
+        """ Get the text we've sent for columns start..end-1 of line y, if
+        all of it is known and drawn with attrs; otherwise None. """
+        if start < 1 or end > self.width + 1 or y < 1 or y > self.height:
+            return None
+        chars = self._shown_chars[y - 1][start - 1:end - 1]
+        cells = self._shown_attrs[y - 1][start - 1:end - 1]
+        if 0 in chars or cells.count(attrs) != len(cells):
+            return None
+        return chars.tobytes().decode(_UTF32)
+
+    def erase(self, attrs: int = A_NORMAL):
+        """ Blank out the whole screen """
+        for y in range(1, self.height + 1):
+            self.put(1, y, " " * self.width, attrs)
+
+    def erase_shown(self):
+        """ Record that the terminal's screen has been cleared """
+        for y in range(self.height):
+            self._shown_chars[y][:] = array.array('I', [ord(' ')]) \
+                    * self.width
+            self._shown_attrs[y][:] = array.array('B', [A_NORMAL]) \
+                    * self.width
+
+    def invalidate(self):
+        """ Forget what's on the terminal, so the next diff sends it all """
+        for y in range(self.height):
+            self._shown_chars[y][:] = array.array('I', [0]) * self.width
+
+    def changes(self):
+        """ Generate (x, y, text, attrs) for each run of cells that differs
+        from what we last sent, and consider them sent. """
+        # pylint: disable=too-many-locals
+        width = self.width
+        gap_max = self.merge_gap
+
+        for y in range(self.height):
+            want_c = self._chars[y]
+            want_a = self._attrs[y]
+            have_c = self._shown_chars[y]
+            have_a = self._shown_attrs[y]
+            if want_c == have_c and want_a == have_a:
+                continue
+
+            x = 0
+            while x < width:
+                if want_c[x] == have_c[x] and want_a[x] == have_a[x]:
+                    x += 1
+                    continue
+
+                attrs = want_a[x]
+                end = x + 1
+                gap = 0
+                while end < width and want_a[end] == attrs:
+                    if want_c[end] == have_c[end] and \
+                            want_a[end] == have_a[end]:
+                        gap += 1
+                    else:
+                        gap = 0
+                    end += 1
+                    if gap > gap_max:
+                        break
+                end -= gap
+
+                # mark each run as sent before handing it out, so anything
+                # looking at the shown cells (like the cursor movement
+                # planner) sees it.
+                have_c[x:end] = want_c[x:end]
+                have_a[x:end] = want_a[x:end]
+                text = want_c[x:end].tobytes().decode(_UTF32)
+                yield (x + 1, y + 1, text, attrs)
+                x = end
+
+__all__ = [
+    "A_NORMAL",
+    "A_BOLD",
+    "A_DIM",
+    "A_UNDERLINE",
+    "A_BLINK",
+    "A_REVERSE",
+    "A_INVISIBLE",
+    "Screen",
+]
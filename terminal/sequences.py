@@ -0,0 +1,176 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module has the escape sequences Terminal sends, already encoded, so
+drawing doesn't have to format and encode the same ones over and over.
+"""
+import functools
+
+from .screen import A_NORMAL, A_BOLD, A_DIM, A_UNDERLINE, A_BLINK, \
+        A_REVERSE, A_INVISIBLE
+
+RIS = b"\x1bc"
+IND = b"\x1bD"
+NEL = b"\x1bE"
+RI = b"\x1bM"
+HTS = b"\x1bH"
+DECSC = b"\x1b7"
+DECRC = b"\x1b8"
+DECKPAM = b"\x1b="
+DECKPNM = b"\x1b>"
+SCOSC = b"\x1b[s"
+SCORC = b"\x1b[u"
+CUP_HOME = b"\x1b[H"
+HVP_HOME = b"\x1b[f"
+DECSTBM_RESET = b"\x1b[r"
+DECAWM_ON = b"\x1b[?7h"
+DECAWM_OFF = b"\x1b[?7l"
+SGR_RESET = b"\x1b[0m"
+ENQ = b"\x05"
+DSR_STATUS = b"\x1b[5n"
+DSR_CPR = b"\x1b[6n"
+DA_PRIMARY = b"\x1b[0c"
+
+# indexed by Ps: 0 is to the end, 1 is from the start, 2 is all of it
+ED = (b"\x1b[0J", b"\x1b[1J", b"\x1b[2J")
+EL = (b"\x1b[0K", b"\x1b[1K", b"\x1b[2K")
+
+# the parameters all come from small ranges (screen coordinates, mode
+# numbers, attribute combinations), so these caches stay small.
+
+@functools.lru_cache(maxsize=1024)
+def escape(s: str):
+    """ ESC s, encoded """
+    return ("\x1b%s" % (s,)).encode('utf-8')
+
+@functools.lru_cache(maxsize=1024)
+def csi_n(n: int, final: str):
+    """ CSI Pn final, as used by CUU, CUD, CUF, CUB, DSR and TBC """
+    return b"\x1b[%d%s" % (n, final.encode('ascii'))
+
+@functools.lru_cache(maxsize=4096)
+def position(x: int, y: int, final: str = 'H'):
+    """ CUP (or HVP, with final 'f') to (x, y) """
+    return b"\x1b[%d;%d%s" % (y, x, final.encode('ascii'))
+
+@functools.lru_cache(maxsize=256)
+def mode(modes: tuple, enable: bool, private: bool = False):
+    """ SM or RM for modes; private modes get the '?' """
+    return b"\x1b[%s%s%s" % (b"?" if private else b"",
+                              b";".join(b"%d" % (m,) for m in modes),
+                              b"h" if enable else b"l")
+
+@functools.lru_cache(maxsize=256)
+def sgr(params: tuple):
+    """ SGR with params; no params means all attributes off """
+    if not params:
+        return SGR_RESET
+    return b"\x1b[%sm" % (b";".join(b"%d" % (p,) for p in params),)
+
+# SGR parameters that turn on each attribute bit
+_SGR_ON = (
+    (A_BOLD, 1),
+    (A_DIM, 2),
+    (A_UNDERLINE, 4),
+    (A_BLINK, 5),
+    (A_REVERSE, 7),
+    (A_INVISIBLE, 8),
+)
+# and the ones that turn them off again; 22 is "normal intensity", which
+# turns off both bold and dim.  There's no way to turn off just
+# invisible on the terminals we care about.
+_SGR_OFF = (
+    (A_BOLD | A_DIM, 22),
+    (A_UNDERLINE, 24),
+    (A_BLINK, 25),
+    (A_REVERSE, 27),
+)
+
+def apply_sgr(attrs, params):
+    """ The rendition after SGR params, starting from attrs (a mask of the
+    A_* bits, or None if we don't know it) """
+    if not params:
+        return A_NORMAL
+    for param in params:
+        if param == 0:
+            attrs = A_NORMAL
+        elif attrs is None:
+            continue
+        for bit, on in _SGR_ON:
+            if param == on:
+                attrs |= bit
+        for bits, off in _SGR_OFF:
+            if param == off:
+                attrs &= ~bits
+    return attrs
+
+@functools.lru_cache(maxsize=4096)
+def sgr_change(have, want: int, off_codes: bool = True):
+    """ The shortest SGR that changes the rendition from have to want,
+    which are masks of the A_* bits; have may be None if we don't know
+    it.  Without off_codes we only use 0 to turn things off, like a real
+    vt100 has to. """
+    if have == want:
+        return b""
+    reset = sgr((0,) + tuple(p for bit, p in _SGR_ON if want & bit))
+    if have is None or not off_codes:
+        return reset
+    lost = have & ~want
+    if lost & A_INVISIBLE:
+        return reset
+
+    params = []
+    gained = want & ~have
+    for bits, off in _SGR_OFF:
+        if lost & bits:
+            params.append(off)
+            # this may have turned off bits we still want
+            gained |= want & bits
+    params.extend(p for bit, p in _SGR_ON if gained & bit)
+    change = sgr(tuple(params))
+    if len(change) < len(reset):
+        return change
+    return reset
+
+@functools.lru_cache(maxsize=1024)
+def stbm(top: int, bottom: int):
+    """ DECSTBM, setting the scrolling region to lines top..bottom """
+    return b"\x1b[%d;%dr" % (top, bottom)
+
+__all__ = [
+    "RIS",
+    "IND",
+    "NEL",
+    "RI",
+    "HTS",
+    "DECSC",
+    "DECRC",
+    "DECKPAM",
+    "DECKPNM",
+    "SCOSC",
+    "SCORC",
+    "CUP_HOME",
+    "HVP_HOME",
+    "DECSTBM_RESET",
+    "DECAWM_ON",
+    "DECAWM_OFF",
+    "SGR_RESET",
+    "ENQ",
+    "DSR_STATUS",
+    "DSR_CPR",
+    "DA_PRIMARY",
+    "ED",
+    "EL",
+    "escape",
+    "csi_n",
+    "position",
+    "mode",
+    "sgr",
+    "apply_sgr",
+    "sgr_change",
+    "stbm",
+]
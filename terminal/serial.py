@@ -8,6 +8,8 @@
 This module provides abstractions for talking to serial ports.
 """
 import array
+import bisect
+import codecs
 from ctypes import c_uint, c_ubyte, Structure
 import fcntl
 import os
@@ -17,6 +19,8 @@ import time
 import selectors
 import termios
 
+from .metrics import default_metrics
+
 TCGETS2 = 0x802C542A
 TCSETS2 = 0x402C542B
 
@@ -68,89 +72,25 @@ class Termios2(Structure):
     def asbuf(self):
         """ This gives the structure as a buffer type """
 
-        buf = array.array('I', [0] * int(self.__sizeof__() / 4))
-        buf[0] = self.c_iflag
-        buf[1] = self.c_oflag
-        buf[2] = self.c_cflag
-        buf[3] = self.c_lflag
-
-        buf[4] = self.c_line         \
-                |(self.c_cc[0] << 8) \
-                |(self.c_cc[1] << 16)\
-                |(self.c_cc[2] << 24)
-
-        buf[5] = (self.c_cc[3])      \
-                |(self.c_cc[4] << 8) \
-                |(self.c_cc[5] << 16)\
-                |(self.c_cc[6] << 24)
-
-        buf[6] = (self.c_cc[7])      \
-                |(self.c_cc[8] << 8) \
-                |(self.c_cc[9] << 16)\
-                |(self.c_cc[10] << 24)
-
-        buf[7] = (self.c_cc[11])      \
-                |(self.c_cc[12] << 8) \
-                |(self.c_cc[13] << 16)\
-                |(self.c_cc[14] << 24)
-
-        buf[8] = (self.c_cc[15])      \
-                |(self.c_cc[16] << 8) \
-                |(self.c_cc[17] << 16)\
-                |(self.c_cc[18] << 24)
-
-        buf[9] = self.c_ispeed
-        buf[10] = self.c_ospeed
+        buf = array.array('I')
+        buf.frombytes(bytes(self))
         return buf
 
     def frombuf(self, buf):
         """ This reads the structure from a buffer type. """
 
-        self.c_iflag = buf[0]
-        self.c_oflag = buf[1]
-        self.c_cflag = buf[2]
-        self.c_lflag = buf[3]
-
-        self.c_line = buf[4] & 0xff
-
-        self.c_cc[0] = (buf[4] & 0xff00) >> 8
-        self.c_cc[1] = (buf[4] & 0xff0000) >> 16
-        self.c_cc[2] = (buf[4] & 0xff000000) >> 24
-        self.c_cc[3] = (buf[5] & 0xff)
-
-        self.c_cc[4] = (buf[5] & 0xff00) >> 8
-        self.c_cc[5] = (buf[5] & 0xff0000) >> 16
-        self.c_cc[6] = (buf[5] & 0xff000000) >> 24
-        self.c_cc[7] = (buf[6] & 0xff)
-
-        self.c_cc[8] = (buf[6] & 0xff00) >> 8
-        self.c_cc[9] = (buf[6] & 0xff0000) >> 16
-        self.c_cc[10] = (buf[6] & 0xff000000) >> 24
-        self.c_cc[11] = (buf[7] & 0xff)
-
-        self.c_cc[12] = (buf[7] & 0xff00) >> 8
-        self.c_cc[13] = (buf[7] & 0xff0000) >> 16
-        self.c_cc[14] = (buf[7] & 0xff000000) >> 24
-        self.c_cc[15] = (buf[8] & 0xff)
-
-        self.c_cc[16] = (buf[8] & 0xff00) >> 8
-        self.c_cc[17] = (buf[8] & 0xff0000) >> 16
-        self.c_cc[18] = (buf[8] & 0xff000000) >> 24
-
-        self.c_ispeed = buf[9]
-        self.c_ospeed = buf[10]
+        memoryview(self).cast('B')[:] = memoryview(buf).cast('B')
 
     def get(self, filedes):
         """ read our termios2 data from the file descriptor """
 
-        buf = self.asbuf()
-        fcntl.ioctl(filedes, TCGETS2, buf)
-        self.frombuf(buf)
+        # ctypes structures are writable buffers, so the kernel can fill
+        # this in directly.
+        fcntl.ioctl(filedes, TCGETS2, self)
 
     def set(self, filedes):
         """ set the file descriptor's attributes from our termios2 data """
-        buf = self.asbuf()
-        fcntl.ioctl(filedes, TCSETS2, buf)
+        fcntl.ioctl(filedes, TCSETS2, self, False)
 
 class SerialPort():
     """ This describes a serial port """
@@ -190,14 +130,31 @@ class SerialPort():
         3500000:termios.B3500000,
         4000000:termios.B4000000,
         }
-
-    def __init__(self, name, use_pty=False):
+    _bauds = sorted(baud_table)
+
+    # how much we ask the kernel for at a time when reading
+    read_size = 4096
+    # the longest line readline() will return in one piece, in bytes
+    max_line = 4096
+
+    def __init__(self, name, use_pty=False, selector=None, metrics=None):
+        """ name: the tty device to open, or "-" for stdin
+            use_pty: make a pty pair instead, and talk to the master side
+            selector: a selectors.BaseSelector to wait on the port with; by
+                      default each port has its own epoll selector, but
+                      several ports can share one.
+            metrics: the metrics.Metrics to count things in; by default
+                     that's metrics.default_metrics
+        """
         if name == "-":
             self.name = "/dev/stdin"
         else:
             self.name = name
         self.device = None
+        # our copy of the port's termios2 settings; it's only re-read from
+        # the kernel by refresh_termios()
         self.termios = Termios2()
+        self._termios_valid = False
         self._master_tty_path = None
         self._master_pty = None
         self._slave_tty_path = None
@@ -205,10 +162,36 @@ class SerialPort():
         self.pty = use_pty
 
         self._speed = 19200
+        # when True, pacing asks the kernel how much output is still queued
+        # (TIOCOUTQ) instead of estimating it from the baud rate, and
+        # drops the safety margin that the estimate needs.
+        self.sync_output = False
+
+        # input we've read from the port but nobody has consumed yet, and
+        # the scratch buffer we read it into.
+        self._rbuf = bytearray()
+        self._rchunk = bytearray(self.read_size)
+        self._rview = memoryview(self._rchunk)
+        self._line_decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        # we only close the selector if it's ours
+        self._own_selector = selector is None
+        if selector is None:
+            selector = selectors.EpollSelector()
+        self.selector = selector
+        self._wait_events = 0
+        # a record.Recorder that gets a copy of everything we send and
+        # receive
+        self.recorder = None
+        if metrics is None:
+            metrics = default_metrics
+        self.metrics = metrics
 
         self._open()
         if self.pty:
             self.set_speed(4000000)
+        else:
+            # so speed is the real line speed from the start
+            self.refresh_termios()
 
     @property
     def speed(self):
@@ -254,96 +237,256 @@ class SerialPort():
                 self._master_pty = os.open(self.name, os.O_RDWR)
 
         self.device = os.fdopen(self.filedes, "w+b", buffering=0)
+        # we wait for the port ourselves, with timeouts, so the writes
+        # must never block.
+        os.set_blocking(self.filedes, False)
+
 
     def fileno(self):
         """ supply a fileno for selecting on """
         return self.filedes
 
+    def close(self):
+        """ Close the port, our selector, and the slave side of our pty if
+        we made one """
+        if self.device is None:
+            return
+        self._unwant()
+        if self._own_selector:
+            self.selector.close()
+        self.device.close()
+        self.device = None
+        if self._slave_pty is not None:
+            os.close(self._slave_pty)
+            self._slave_pty = None
+
+    def _want(self, events):
+        """ Make our selector registration be for events """
+
+        # on our own selector the registration stays put between calls; we
+        # only pay for an epoll_ctl() when we switch between waiting to
+        # read and waiting to write.
+        if events != self._wait_events:
+            if self._wait_events:
+                self.selector.modify(self.filedes, events, self)
+            else:
+                self.selector.register(self.filedes, events, self)
+            self._wait_events = events
+
+    def _unwant(self):
+        """ Drop our selector registration, if we have one """
+        if self._wait_events:
+            self.selector.unregister(self.filedes)
+            self._wait_events = 0
+
+    def _wait(self, events, timeout=None):
+        """ Wait up to timeout for the port to be ready for events.  Returns
+        the events that are ready, or 0 if we timed out. """
+
+        self._want(events)
+        try:
+            deadline = None
+            if timeout is not None:
+                deadline = time.monotonic() + timeout
+            while True:
+                ready = self.selector.select(timeout)
+                self.metrics.count("poll.wakeups")
+                for key, mask in ready:
+                    if key.fd == self.filedes and mask & events:
+                        return mask & events
+                # a shared selector can wake us up for someone else's port.
+                if deadline is not None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        return 0
+        finally:
+            if not self._own_selector:
+                # left registered, our port being ready would keep waking
+                # up whoever waits on the selector next.
+                self._unwant()
+
+    def _fill_input(self, timeout=None):
+        """ Wait up to timeout for input, and add whatever is available to
+        our input buffer in one read.  Returns how many bytes we got. """
+
+        if not self._wait(selectors.EVENT_READ, timeout):
+            return 0
+        return self._read_available()
+
+    def _read_available(self):
+        """ Add whatever input is ready right now to our input buffer """
+        self.metrics.count("read.syscalls")
+        try:
+            n = os.readv(self.filedes, [self._rchunk])
+        except BlockingIOError:
+            return 0
+        self.metrics.count("read.bytes", n)
+        self._rbuf += self._rview[:n]
+        if self.recorder is not None and n:
+            self.recorder.received(self._rview[:n])
+        return n
+
+    def _write_some(self, data):
+        """ Write as much of data as the port will take right now, and
+        return how much that was """
+        self.metrics.count("write.syscalls")
+        n = os.write(self.filedes, data)
+        self.metrics.count("write.bytes", n)
+        if self.recorder is not None and n:
+            self.recorder.sent(data[:n])
+        return n
+
+    def _take_input(self, count=None):
+        """ Remove count bytes (or everything) from our input buffer """
+        if count is None or count >= len(self._rbuf):
+            ret = bytes(self._rbuf)
+            self._rbuf.clear()
+        else:
+            ret = bytes(self._rbuf[:count])
+            del self._rbuf[:count]
+        return ret
+
     def read(self, count=None, timeout=None):
         """ read from our port """
 
-        selector = selectors.PollSelector()
-        selector.register(self.filedes, selectors.EVENT_READ)
-        ret = bytes()
-
-        while count is None or count > 0:
+        while count is None or len(self._rbuf) < count:
             before = time.time()
-            events = selector.select(timeout=timeout)
-
-            if not events:
-                raise TimeoutError(ret)
-
-            for key, mask in events:
-                if mask & selectors.EVENT_READ:
-                    b = os.read(key.fd, 1)
-                    ret += b
-                    if count is not None:
-                        count -= 1
+            if not self._fill_input(timeout):
+                raise TimeoutError(self._take_input())
 
             after = time.time()
             if not timeout is None:
-                timeout -= after - before
+                timeout = max(timeout - (after - before), 0)
+
+        return self._take_input(count)
+
+    def _next_line(self, start=0, max_line=None):
+        """ Take the next line out of our input buffer and decode it, or
+        return None if there isn't a whole one yet.  start is how far into
+        the buffer we've already looked for a newline.  A line longer than
+        max_line bytes comes back in pieces that long. """
+        if max_line is None:
+            max_line = self.max_line
+        # the newline isn't part of the line, so it can be one past
+        # max_line; only once we've seen that it isn't do we split.
+        nl = self._rbuf.find(b'\n', start, max_line + 1)
+        if nl >= 0:
+            line = self._take_input(nl + 1)[:-1]
+        elif len(self._rbuf) > max_line:
+            line = self._take_input(max_line)
+        else:
+            return None
+        # a character split by max_line is finished off with the next
+        # piece of the line, but one cut short by the newline is just
+        # invalid, and mustn't spill over onto the next line.
+        return self._line_decoder.decode(line, final=nl >= 0) \
+                .replace('\r', '')
+
+    def readline(self, timeout=None, max_line=None):
+        """ read a line from our port, without the line ending.  Invalid
+        UTF-8 comes out as U+FFFD, and lines longer than max_line bytes
+        are split. """
+        start = 0
+        while True:
+            line = self._next_line(start, max_line)
+            if line is not None:
+                return line
+            start = len(self._rbuf)
 
-        return ret
+            before = time.time()
+            if not self._fill_input(timeout):
+                raise TimeoutError(bytes(self._rbuf))
+            after = time.time()
+            if not timeout is None:
+                timeout = max(timeout - (after - before), 0)
 
-    def readline(self, timeout=None):
-        """ read a line from our port """
-        line = ""
+    def readlines(self, timeout=None, max_line=None):
+        """ Generate lines from our port as they arrive, like readline(),
+        until one takes longer than timeout to show up """
         while True:
-            c = self.read(count=1, timeout=timeout)
-            c = c.decode('utf-8')
-            if c == '\n':
-                break
-            if c != '\r':
-                line += c
-        return line
+            try:
+                yield self.readline(timeout, max_line)
+            except TimeoutError:
+                return
 
     def write(self, buf, timeout=None):
-        """ write to our serial port """
-
-        buflist = list(buf)
-        selector = selectors.PollSelector()
-        selector.register(self.filedes, selectors.EVENT_WRITE)
+        """ write to our serial port.  buf can be a str, which we'll encode
+        as UTF-8, or bytes, bytearray, memoryview, or anything else with
+        the buffer protocol, which we'll write without copying. """
+
+        if isinstance(buf, str):
+            buf = buf.encode('utf-8')
+        view = memoryview(buf).cast('B')
+        total = len(view)
         ret = 0
 
-        while buflist:
-            before = time.time()
-            events = selector.select(timeout)
+        while ret < total:
+            try:
+                ret += self._write_some(view[ret:])
+                continue
+            except BlockingIOError:
+                pass
 
-            if not events:
+            before = time.time()
+            if not self._wait(selectors.EVENT_WRITE, timeout):
                 raise TimeoutError(ret)
-
-            for key, mask in events:
-                if mask & selectors.EVENT_WRITE and key.fd == self.filedes:
-                    c = buflist.pop(0)
-                    ret += os.write(key.fd, bytes(c, "UTF-8"))
-
             after = time.time()
             if not timeout is None:
-                timeout -= after - before
+                timeout = max(timeout - (after - before), 0)
 
         return ret
 
-    def get_speed(self):
-        """ get the output speed """
+    def output_pending(self):
+        """ How many bytes are still in the kernel's output queue """
+        buf = array.array('i', [0])
+        fcntl.ioctl(self.filedes, termios.TIOCOUTQ, buf)
+        return buf[0]
+
+    def wait_sent(self):
+        """ Block until everything we've written has been transmitted """
+        termios.tcdrain(self.filedes)
 
+    def refresh_termios(self):
+        """ Re-read our termios2 settings from the kernel, in case someone
+        else has changed them behind our back """
         self.termios.get(self.filedes)
+        self._termios_valid = True
         self._speed = self.termios.c_ospeed
+
+    def _cached_termios(self):
+        """ Our termios2 settings, reading them only the first time """
+        if not self._termios_valid:
+            self.refresh_termios()
+        return self.termios
+
+    def get_speed(self):
+        """ get the output speed """
+
+        self._cached_termios()
         return self.speed
 
+    @classmethod
+    def _nearest_baud(cls, speed, close):
+        """ The standard rate nearest speed, if it's within close of it """
+        i = bisect.bisect_left(cls._bauds, speed)
+        best = None
+        for baud in cls._bauds[max(i - 1, 0):i + 1]:
+            if abs(baud - speed) <= close and \
+                    (best is None or abs(baud - speed) < abs(best - speed)):
+                best = baud
+        return best
+
     def set_speed(self, speed):
         """ Set the speed """
 
         if self.pty:
             return
 
-        ifound = False
-        ofound = False
         iclose = speed/50
         oclose = speed/50
         ibinput = False
 
-        self.termios.get(self.filedes)
+        self._cached_termios()
 
         self.termios.c_ispeed = self.termios.c_ospeed = speed
 
@@ -354,32 +497,51 @@ class SerialPort():
         if (self.termios.c_cflag >> IBSHIFT) & termios.CBAUD:
             ibinput = True
 
-        self.termios.c_cflag &= ~termios.CBAUD
-
-        bauds = list(SerialPort.baud_table.keys())
-        bauds.sort()
-        for i in range(0, len(SerialPort.baud_table)):
-            baud = bauds[i]
-            bits = SerialPort.baud_table[baud]
-
-            if speed - oclose <= baud and speed + oclose >= baud:
-                self.termios.c_cflag |= bits
-                ofound = i
-            if speed - iclose <= baud and speed + iclose >= baud:
-                if ofound == i and not ibinput:
-                    ifound = i
-                else:
-                    ifound = i
-                    self.termios.c_cflag |= bits << IBSHIFT
-        if ofound is False:
-            self.termios.c_cflag = BOTHER
-
-        if ifound is False and ibinput:
-            self.termios.c_cflag |= BOTHER << IBSHIFT
+        self.termios.c_cflag &= ~(termios.CBAUD | (termios.CBAUD << IBSHIFT))
+
+        obaud = self._nearest_baud(speed, oclose)
+        if obaud is None:
+            self.termios.c_cflag |= BOTHER
+        else:
+            self.termios.c_cflag |= SerialPort.baud_table[obaud]
+
+        ibaud = self._nearest_baud(speed, iclose)
+        if ibaud is None:
+            if ibinput:
+                self.termios.c_cflag |= BOTHER << IBSHIFT
+        elif ibaud != obaud or ibinput:
+            self.termios.c_cflag |= SerialPort.baud_table[ibaud] << IBSHIFT
 
         self.termios.set(self.filedes)
         self._speed = speed
 
+    def setattr(self, **changes):
+        """ Change any of iflag, oflag, cflag, lflag, line, ispeed, ospeed,
+        and cc (a dict of index: value) in our cached settings, and apply
+        them all with one TCSETS2. """
+        t = self._cached_termios()
+        fields = {
+            'iflag': 'c_iflag',
+            'oflag': 'c_oflag',
+            'cflag': 'c_cflag',
+            'lflag': 'c_lflag',
+            'line': 'c_line',
+            'ispeed': 'c_ispeed',
+            'ospeed': 'c_ospeed',
+        }
+        for key, value in changes.items():
+            if key == 'cc':
+                for index, char in value.items():
+                    t.c_cc[index] = char
+            elif key in fields:
+                setattr(t, fields[key], value)
+            else:
+                raise TypeError(
+                    "setattr() got an unexpected keyword argument '%s'" %
+                    (key,))
+        t.set(self.filedes)
+        self._speed = t.c_ospeed
+
     def getattr(self):
         """ Get our tty's attributes """
         attrs = tty.tcgetattr(self.filedes)
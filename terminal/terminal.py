@@ -9,19 +9,115 @@
 This module provides abstractions for talking to a terminal.
 """
 
-import os
-import time
+import collections
+import contextlib
+import functools
+import re
 import selectors
+import termios
+import time
 
+from . import parser
+from . import sequences
+from .movement import MovePlanner
+from .pacing import Pacer
+from .profile import Profile
 from .serial import SerialPort
+from .screen import Screen, A_NORMAL
+
+# SGR keyword arguments and their parameters
+_SGR_PARAMS = {
+    "attributes_off": 0,    # vt100 vt102 w60
+    "bold": 1,              # vt100 vt102 w60
+    "dim": 2,               #             w60
+    "underline": 4,         # vt100 vt102 w60
+    "blink": 5,             # vt100 vt102 w60
+    "reverse": 7,           # vt100 vt102 w60
+    "invisible": 8,         #             w60
+    "normal": 22,           #             w60
+    "underline_off": 24,    #             w60
+    "blink_off": 25,        #             w60
+    "reverse_off": 27,      #             w60
+}
+# pairs of SGR keywords that can't be used together
+_SGR_EXCLUSIVE = (
+    frozenset(("bold", "dim")),
+    frozenset(("bold", "invisible")),
+    frozenset(("dim", "invisible")),
+)
+
+# the characters that don't just print and move right one column
+_CONTROL_RE = re.compile("[\x00-\x1f\x7f]")
+
+class Query():
+    """ A question we've sent the terminal.  Replies come back in the
+    order the questions went out, so each one answers the oldest
+    outstanding Query that is waiting for that kind of reply. """
+
+    def __init__(self, terminal, sequence, kind, convert=None, once=False):
+        # pylint: disable=too-many-arguments
+        self.terminal = terminal
+        self.sequence = sequence
+        self.kind = kind
+        self.convert = convert
+        # don't ask again if there's no answer; whoever's waiting gets
+        # None instead
+        self.once = once
+        self.event = None
+        self.error = None
+        self.asked_at = time.monotonic()
+
+    def done(self):
+        """ Has this been answered (or given up on) yet? """
+        return self.event is not None or self.error is not None
+
+    def _value(self):
+        """ the answer, or the reason there isn't one """
+        if self.error is not None:
+            raise self.error
+        if self.convert is None:
+            return self.event
+        return self.convert(self.event)
+
+    def result(self, timeout=None):
+        """ Wait for the answer and return it """
+        # pylint: disable=protected-access
+        self.terminal._pump_until(self.done, timeout)
+        return self._value()
+
+    async def wait(self, timeout=None):
+        """ Wait for the answer on the event loop (AsyncTerminal only) """
+        # pylint: disable=protected-access
+        await self.terminal._pump_until_async(self.done, timeout)
+        return self._value()
+
+    def retry(self):
+        """ Ask the same question again """
+        # pylint: disable=protected-access
+        return self.terminal._query(self.sequence, self.kind, self.convert,
+                                    self.once)
 
 class Terminal(SerialPort):
     """ This provides a terminal we can write to """
     # pylint: disable=too-many-public-methods
 
-    def __init__(self, name, use_pty=False):
-        SerialPort.__init__(self, name, use_pty)
-        print("[Terminal %s].__init__(name=\"%s\")" % (self.name, self.name))
+    def __init__(self, name, use_pty=False, trust_model=False,
+                 check_every=0, selector=None, profiles=None,
+                 fast_probe=False, metrics=None):
+        """ trust_model: don't ask the terminal where the cursor is after
+                         each write; just track it ourselves
+            check_every: when trusting the model, still check the real
+                         position every this many operations (0 = never)
+            selector: see SerialPort
+            profiles: a ProfileCache; setup() skips measuring the screen
+                      when it has a profile for this terminal
+            fast_probe: have setup() measure the screen with one clamped
+                        cursor move instead of by writing to it
+            metrics: see SerialPort
+        """
+        # pylint: disable=too-many-arguments
+        SerialPort.__init__(self, name, use_pty, selector, metrics)
+        self.metrics.trace("terminal.open", name=self.name)
 
         self.count = 0
 
@@ -35,23 +131,56 @@ class Terminal(SerialPort):
         self.max_y = 24
 
         self.seen_valid_ps = False
+        self.parser = parser.InputParser()
+        # things the terminal sent that nobody has asked for yet
+        self._events = []
+        # Query()s still waiting for a reply, oldest first
+        self._queries = collections.deque()
+        # what _expect() is waiting for, if it is
+        self._expecting = None
 
         self.Pt = self.min_y
         self.Pb = self.max_y
         self.scroll_enabled = False
 
         self.cursor_saved = False
+        # the graphic rendition in effect, as A_* bits, or None when we
+        # don't know what it is
+        self.rendition = None
+        self.saved_rendition = None
+        # whether the terminal understands SGR 22, 24, 25 and 27 for
+        # turning attributes off; a real vt100 only has 0.
+        self.sgr_off_codes = True
 
         self.autowrap = True
         self.autoscroll = True
-
-        selector = selectors.PollSelector()
-        selector.register(self.filedes,
-                          selectors.EVENT_READ|selectors.EVENT_WRITE)
-        self.selector = selector
+        # we've printed in the last column, and the next printable
+        # character wraps to the next line first
+        self.wrap_pending = False
+
+        self.trust_model = trust_model
+        self.check_every = check_every
+        self._unchecked_ops = 0
+        self.profiles = profiles
+        self.fast_probe = fast_probe
+        # how long the terminal took to answer a query, when setup() has
+        # timed it; we don't give up waiting on one any sooner than that.
+        self.round_trip = None
+
+        self._batch_depth = 0
+        self._outbuf = bytearray()
+        # (offset, n) pairs: fill(n) was called inside batch() after the
+        # first offset bytes of _outbuf
+        self._fills = []
+        self.pacer = Pacer(self)
+
+        self.screen = Screen(self.max_x, self.max_y)
+        self.planner = MovePlanner()
 
     def _get_timeout(self, timeout=None):
         if timeout is None:
+            if self.round_trip is not None:
+                return max(self.timeout, self.round_trip)
             return self.timeout
         return timeout
 
@@ -61,26 +190,18 @@ class Terminal(SerialPort):
         mode: the mode number
         group: 1 means no ?, 2 means ?
         """
-        modestr = "".join(("%d;" % (mode,) for mode in modes))[:-1]
-        if group == 1:
-            self.escape("[%sh" % (modestr,))
-        elif group == 2:
-            self.escape("[?%sh" % (modestr,))
-        else:
+        if group not in (1, 2):
             raise ValueError("SM: no such group %s" % (group,))
+        self._write(sequences.mode(tuple(modes), True, group == 2))
 
     def RM(self, modes, group=1):
         """ Reset Mode
         mode: the mode number
         group: 1 means no ?, 2 means ?
         """
-        modestr = "".join(("%d;" % (mode,) for mode in modes))[:-1]
-        if group == 1:
-            self.escape("[%sl" % (modestr,))
-        elif group == 2:
-            self.escape("[?%sl" % (modestr,))
-        else:
+        if group not in (1, 2):
             raise ValueError("SM: no such group %s" % (group,))
+        self._write(sequences.mode(tuple(modes), False, group == 2))
 
     def mode(self, mode, enable, group=1):
         """ Set or Reset mode
@@ -170,6 +291,44 @@ class Terminal(SerialPort):
 
     def setup(self):
         """ Actually set up the terminal for drawing to """
+        steps = self._setup_steps()
+        result = None
+        while True:
+            try:
+                query = steps.send(result)
+            except StopIteration:
+                return
+            result = self._ask(query)
+
+    def _setup_steps(self):
+        """ The steps of setup().  Whenever we need something from the
+        terminal, we yield the Query that asks for it and whoever is
+        driving us sends back the answer; that lets the same steps run
+        blocking here or from an event loop. """
+        profile = None
+        identity = None
+        if self.profiles is not None:
+            # ask before the reset, so nothing else is in the way of
+            # timing the answer.  A terminal without DA may still have an
+            # answerback message to know it by; with neither, we measure
+            # it and don't cache what we find.
+            start = time.monotonic()
+            da = yield self.query_identity()
+            if da is not None:
+                identity = ("da", da)
+            else:
+                start = time.monotonic()
+                answerback = yield self.query_answerback()
+                if answerback:
+                    identity = ("answerback", answerback)
+            round_trip = time.monotonic() - start
+            if identity is not None:
+                self.round_trip = round_trip
+                profile = self.profiles.lookup(self.name, identity,
+                                               self.speed)
+            if profile is not None:
+                self.round_trip = max(round_trip, profile.round_trip)
+
         self.RIS()
 
         #self.escape("<")
@@ -184,14 +343,73 @@ class Terminal(SerialPort):
         self.CRM(False)
         self.SRTM(False)
 
+        if profile is None:
+            if self.fast_probe:
+                yield from self._probe_geometry_fast()
+            else:
+                yield from self._probe_geometry()
+            if identity is not None:
+                self.profiles.store(self.name,
+                                    Profile(self.min_x, self.min_y,
+                                            self.max_x, self.max_y,
+                                            identity, self.speed,
+                                            round_trip))
+        else:
+            self.min_x = profile.min_x
+            self.min_y = profile.min_y
+            self.max_x = profile.max_x
+            self.max_y = profile.max_y
+
+        self.fill(self.speed / 20)
+        if not self.scroll_enabled:
+            self.Pt = self.min_y
+            self.Pb = self.max_y
+
+        #print("min xy is (%d, %d) max xy is (%d, %d)" % (self.min_x,
+        #                                                 self.min_y,
+        #                                                 self.max_x,
+        #                                                 self.max_y))
+
+        self.screen = Screen(self.max_x, self.max_y)
+
+        self.fill(self.speed / 20)
+        self.clear()
+        self.fill(self.speed / 20)
+        self.gohome()
+
+        # print("checking position")
+        self.set_position(self.min_x, self.min_y)
+
+    def _probe_geometry_fast(self):
+        """ Measure the screen by moving the cursor far past the bottom
+        right corner, which the terminal clamps to the real corner, and
+        asking where it ended up.  That's one round trip, and unlike
+        _probe_geometry() it doesn't draw anything.  It also gets the size
+        right when that's narrower or shorter than 80x24, wider than 80, or
+        taller than the 30 lines _probe_geometry() scrolls down, all of
+        which _probe_geometry() gets wrong. """
+        self.min_x = 1
+        self.min_y = 1
+        self.CUP(999, 999, force=True)
+        x, y = yield self.query_position()
+        self.max_x = x
+        self.max_y = y
+        # we've just been told where the cursor is, so there's nothing to
+        # check.
+        self.cur_x = x
+        self.cur_y = y
+        self.wrap_pending = False
+
+    def _probe_geometry(self):
+        """ The part of _setup_steps() that measures the screen """
         self.CUP(force=True)
         self.fill(self.speed / 10)
-        x, y = self.getpos()
+        x, y = yield self.query_position()
         self.fill(self.speed / 10)
         self.min_x = x
         self.CUP(x, x, force=True)
         self.fill(self.speed / 20)
-        x, y = self.getpos()
+        x, y = yield self.query_position()
         self.fill(self.speed / 20)
         self.min_y = y
 
@@ -199,39 +417,18 @@ class Terminal(SerialPort):
             #print("%d " % (x,),)
             self.NEL()
 
-        self.check_position()
-
         self.fill(self.speed / 20)
-        x, y = self.getpos()
+        x, y = yield self.query_position()
         self.fill(self.speed / 20)
-        if y > self.max_y:
-            self.max_y = y
+        self._correct_position(x, y)
 
         self._write(" " * 999)
         self.fill(self.speed / 20)
-        x, y = self.getpos()
+        x, y = yield self.query_position()
         self.fill(self.speed / 20)
         if x > self.max_x:
             self.max_x = x
 
-        self.fill(self.speed / 20)
-        if not self.scroll_enabled:
-            self.Pt = self.min_y
-            self.Pb = self.max_y
-
-        #print("min xy is (%d, %d) max xy is (%d, %d)" % (self.min_x,
-        #                                                 self.min_y,
-        #                                                 self.max_x,
-        #                                                 self.max_y))
-
-        self.fill(self.speed / 20)
-        self.clear()
-        self.fill(self.speed / 20)
-        self.gohome()
-
-        # print("checking position")
-        self.set_position(self.min_x, self.min_y)
-
     @property
     def x(self):
         """ current x position """
@@ -247,11 +444,30 @@ class Terminal(SerialPort):
         right place."""
 
         x, y = self.getpos()
+        self._correct_position(x, y)
+
+    def _correct_position(self, x, y):
+        """ The terminal says the cursor is at (x, y); if that's not where
+        we think it is, put it there. """
+        self._unchecked_ops = 0
+        self.metrics.count("position.checks")
         if x != self.cur_x or y != self.cur_y:
-            print("Current position is (%d,%d), expected (%d,%d).  Moving."
-                  % (x, y, self.cur_x, self.cur_y))
+            self.metrics.count("position.mismatches")
+            self.metrics.trace("position.mismatch", name=self.name,
+                               actual=(x, y),
+                               expected=(self.cur_x, self.cur_y))
             self.gotoxy(self.cur_x, self.cur_y, force=True)
 
+    def _auto_check_position(self):
+        """ check_position() after an operation, unless we're trusting our
+        own model and it isn't time for a spot check yet. """
+        if self.trust_model:
+            self._unchecked_ops += 1
+            if not self.check_every or \
+                    self._unchecked_ops < self.check_every:
+                return
+        self.check_position()
+
     def set_position(self, x, y):
         """ Set our internal idea of the current position """
         self.cur_x = x
@@ -261,21 +477,30 @@ class Terminal(SerialPort):
         self.cur_y = y
         if y > self.max_y:
             self.cur_y = self.max_y
+        self.wrap_pending = False
 
-        self.check_position()
+        self._auto_check_position()
         #try:
         #    self.check_position()
         #except ValueError:
         #    self.drain()
         #    self.set_position(x, y)
 
+    def _homed(self):
+        """ The terminal has put the cursor in the top left corner by
+        itself, as RIS and DECSTBM do """
+        self.cur_x = self.min_x
+        self.cur_y = self.min_y
+        self.wrap_pending = False
+
     def decrement_line(self, n: int = 1):
         """ Move our internal representation of position up one row """
-        self.cur_y -= n
-        if self.cur_y < self.min_y:
-            self.cur_y = self.min_y
-        if self.scroll_enabled and self.cur_y == self.Pt - 1:
-            self.cur_y = self.Pt
+        self.wrap_pending = False
+        # the top margin stops us, unless we started above it
+        top = self.min_y
+        if self.scroll_enabled and self.cur_y >= self.Pt:
+            top = self.Pt
+        self.cur_y = max(self.cur_y - n, top)
 
     def decrement_row(self, n: int = 1):
         """ Move our internal representation of position up one row """
@@ -283,11 +508,12 @@ class Terminal(SerialPort):
 
     def increment_line(self, n: int = 1):
         """ Move our internal representation of position down one row """
-        self.cur_y += n
-        if self.cur_y > self.max_y:
-            self.cur_y = self.max_y
-        if self.scroll_enabled and self.cur_y == self.Pb + 1:
-            self.cur_y = self.Pb
+        self.wrap_pending = False
+        # the bottom margin stops us, unless we started below it
+        bottom = self.max_y
+        if self.scroll_enabled and self.cur_y <= self.Pb:
+            bottom = self.Pb
+        self.cur_y = min(self.cur_y + n, bottom)
 
     def increment_row(self, n: int = 1):
         """ Move our internal representation of position down one row """
@@ -295,20 +521,68 @@ class Terminal(SerialPort):
 
     def decrement_col(self, n: int = 1):
         """ Move our internal representation of position left one col """
+        self.wrap_pending = False
         self.cur_x -= n
         if self.cur_x < self.min_x:
             self.cur_x = self.min_x
 
     def increment_col(self, n: int = 1):
         """ Move our internal representation of position right one col """
+        self.wrap_pending = False
         self.cur_x += n
         if self.cur_x > self.max_x:
             self.cur_x = self.max_x
 
     def _write(self, buf, timeout=None):
-        """ A proxy for SerialPort.write() """
+        """ A proxy for SerialPort.write() that honors batch() """
+
+        if isinstance(buf, str):
+            buf = buf.encode('utf-8')
+        if self._batch_depth:
+            self._outbuf += buf
+            return len(buf)
+        return self._send(buf, timeout)
+
+    def _send(self, buf, timeout=None):
+        """ Write buf to the port once the terminal is ready for it """
+        self.pacer.wait()
+        ret = SerialPort.write(self, buf, timeout)
+        self.pacer.sent(ret)
+        return ret
 
-        return SerialPort.write(self, buf, timeout)
+    @contextlib.contextmanager
+    def batch(self):
+        """ Queue up everything written inside the with block and send it
+        with as few writes as we can manage when the block exits.  Batches
+        may be nested; only the outermost one flushes. """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth:
+                self.flush()
+
+    def flush(self, timeout=None):
+        """ Send anything batch() has queued up, with the delays fill()
+        queued along with it """
+        if not self._outbuf and not self._fills:
+            return 0
+        buf = memoryview(bytes(self._outbuf))
+        self._outbuf.clear()
+        fills = self._fills
+        self._fills = []
+
+        ret = 0
+        start = 0
+        for offset, n in fills:
+            if offset > start:
+                ret += self._send(buf[start:offset], timeout)
+                start = offset
+            self.pacer.delay(n)
+        if len(buf) > start:
+            ret += self._send(buf[start:], timeout)
+        return ret
 
     def write(self, buf, timeout=None, limit=None):
         """ Write text to the screen """
@@ -329,45 +603,248 @@ class Terminal(SerialPort):
         else:
             sl = 0
         buf += " " * sl
-        self.increment_col(sl)
 
         # print("len(%s): %s" % (ns, len(ns)))
         self._write(buf)
-        self.increment_col(l)
-        sl = len(buf)
-        ls = 0
-        while buf:
-            try:
-                nl = buf.index('\n')
-                self.increment_row()
-                buf = buf[nl+1:]
-                ls += 1
-            except ValueError:
-                break
-
-        # print("write() %d characters, %d newlines: " % (nsl, nls))
-        # print("\"%s\"" % (ns.strip()))
-        self.check_position()
+        self.advance(buf)
+        self._auto_check_position()
+
+    @property
+    def onlcr(self):
+        """ Whether the tty driver turns each LF we send into CR LF on its
+        way to the terminal.  Writing to a pty master goes to the slave's
+        input, so output processing never touches it. """
+        if self.pty:
+            return False
+        oflag = self._cached_termios().c_oflag
+        return oflag & (termios.OPOST | termios.ONLCR) == \
+                termios.OPOST | termios.ONLCR
+
+    def _linefeed(self):
+        """ Move the model down a line the way LF does, scrolling (and so
+        staying put) at the bottom margin """
+        self.wrap_pending = False
+        if self.cur_y == self.Pb:
+            return
+        if self.cur_y < self.max_y:
+            self.cur_y += 1
+
+    def _print(self, n: int):
+        """ Move the model over n printed characters """
+        while n > 0:
+            if self.wrap_pending:
+                self.wrap_pending = False
+                self.cur_x = self.min_x
+                self._linefeed()
+            room = self.max_x - self.cur_x + 1
+            if n < room or not self.autowrap:
+                self.cur_x = min(self.cur_x + n, self.max_x)
+                return
+            # this fills up the line; the next character wraps.
+            n -= room
+            self.cur_x = self.max_x
+            self.wrap_pending = True
+
+    def advance(self, text: str):
+        """ Update the cursor model for text having been written, in one
+        pass: printable runs advance (and wrap) the cursor, and the usual
+        control characters do what the terminal does with them. """
+        pos = 0
+        for match in _CONTROL_RE.finditer(text):
+            start = match.start()
+            if start > pos:
+                self._print(start - pos)
+            pos = start + 1
+
+            c = text[start]
+            if c in "\n\x0b\x0c":
+                if c == '\n' and self.onlcr:
+                    self.cur_x = self.min_x
+                self._linefeed()
+            elif c == '\r':
+                self.wrap_pending = False
+                self.cur_x = self.min_x
+            elif c == '\b':
+                self.wrap_pending = False
+                self.cur_x = max(self.cur_x - 1, self.min_x)
+            elif c == '\t':
+                self.wrap_pending = False
+                self.cur_x = min(((self.cur_x - 1) // 8 + 1) * 8 + 1,
+                                 self.max_x)
+        if len(text) > pos:
+            self._print(len(text) - pos)
 
     def escape(self, s=""):
         """ Write an escaped character """
         # print("s: \"%s\"" % (s,))
-        s = "\x1b%s" % (s,)
-        self._write(s)
+        self._write(sequences.escape(s))
+
+    def _fill_time(self, n):
+        """ How long fill(n) delays the terminal, in seconds """
+        return self.pacer.delay_time(n)
 
     def fill(self, n, obey_our_dec_masters=False):
-        """ Write n NUL chararacters to the terminal to delay it... """
+        """ Write n NUL chararacters to the terminal to delay it...
+
+        Or, more usually, tell the pacer the terminal needs that long before
+        it sees anything else.  We don't sleep here; the next write waits
+        out whatever is left of the delay, so the caller can get on with
+        other things (and batch() can keep queueing) in the meantime. """
         if self.pty:
             return
+        self.metrics.time("fill", self.pacer.delay_time(n))
         if obey_our_dec_masters:
             # DEC says to write NUL a bunch.  Results do not seem to be good.
             self._write("\x00" * n)
+        elif self._batch_depth:
+            # the delay is for what's queued so far, so flush() takes it
+            # when it gets that far.
+            self._fills.append((len(self._outbuf), n))
         else:
-            speed = self.get_speed()
-            # nerf it up /just a little/
-            t = (n * 1.2) / speed
-            # print("sleeping %d/19200 = %f" % (n * 1.2, t))
-            time.sleep(t)
+            self.pacer.delay(n)
+
+    def _parse_input(self, timeout=None):
+        """ Feed whatever input is available (waiting up to timeout for
+        some) to the parser and queue up the events.  Returns how many
+        bytes we parsed. """
+        if not self._rbuf and not self._fill_input(timeout):
+            return 0
+        data = self._take_input()
+        self._dispatch(self.parser.feed(data))
+        return len(data)
+
+    def _dispatch(self, events):
+        """ Hand replies to the Query()s waiting for them, and queue up
+        everything else for get_event() """
+        # pylint: disable=protected-access
+        for event in events:
+            for query in self._queries:
+                if isinstance(event, query.kind):
+                    self._queries.remove(query)
+                    query.event = event
+                    self.metrics.time("query." + query.kind.__name__,
+                                      time.monotonic() - query.asked_at)
+                    break
+            else:
+                if self._queries or (self._expecting is not None and
+                                     not self._expecting(event)):
+                    # not what we're waiting for
+                    self.metrics.count("input.stray")
+                self._events.append(event)
+
+    def _pump_until(self, ready, timeout=None):
+        """ Parse input until ready() is true.  We give up with TimeoutError
+        when timeout passes four times in a row with no input at all, not
+        counting the time it takes what we've sent to reach the terminal. """
+        self.flush()
+        timeout = self._get_timeout(timeout)
+        # the terminal can't answer until it's seen everything before the
+        # question, so the idle clock starts once that's on the wire.
+        done_at = self.pacer.done_at()
+        idle = 0
+        while not ready():
+            if self._parse_input(timeout):
+                idle = 0
+            elif time.monotonic() >= done_at:
+                idle += 1
+                if idle == 4:
+                    raise TimeoutError(timeout * idle)
+
+    def _query(self, sequence, kind, convert=None, once=False):
+        """ Send sequence, and get a Query for the kind of event that
+        answers it """
+        self._write(sequence)
+        query = Query(self, sequence, kind, convert, once)
+        self._queries.append(query)
+        return query
+
+    def _ask(self, query):
+        """ Wait for query's answer, asking again if the terminal doesn't
+        seem to have heard us """
+        while True:
+            try:
+                return query.result()
+            except TimeoutError:
+                self._query_timed_out(query)
+                self.drain()
+                if query.once:
+                    return None
+                query = query.retry()
+
+    def _query_timed_out(self, query):
+        """ Note that query went unanswered """
+        self.metrics.count("query.timeouts")
+        self.metrics.trace("query.timeout", name=self.name,
+                           kind=query.kind.__name__)
+
+    def query_position(self):
+        """ Ask where the cursor is (DSR 6), without waiting for the answer.
+        Several queries can be outstanding at once; the Query's result() is
+        (x, y). """
+        return self._query(sequences.DSR_CPR, parser.CPR,
+                           self._CPR_position)
+
+    def query_status(self):
+        """ Ask for the terminal's status (DSR 5) without waiting; the
+        Query's result() is the status, 0 meaning all is well. """
+        return self._query(sequences.DSR_STATUS, parser.DSR,
+                           lambda event: event.status)
+
+    def query_attributes(self):
+        """ Ask for the device attributes (DA) without waiting; the Query's
+        result() is the same as DA()'s """
+        return self._query(sequences.DA_PRIMARY, parser.DA,
+                           lambda event: self._DA_answer(event.options))
+
+    def query_identity(self):
+        """ Ask for the device attributes without waiting; the Query's
+        result() is the raw DA parameters, which is what a ProfileCache
+        tells terminals apart by.  We only ask once, so a terminal that
+        doesn't do DA answers None. """
+        return self._query(sequences.DA_PRIMARY, parser.DA,
+                           lambda event: event.options, once=True)
+
+    def query_answerback(self):
+        """ Send ENQ without waiting; the Query's result() is the first
+        text the terminal sends back, which should be its answerback
+        message, or None if it doesn't send any. """
+        return self._query(sequences.ENQ, parser.Text,
+                           lambda event: event.text, once=True)
+
+    def _CPR_position(self, event):
+        """ (x, y) from a CPR event """
+        pos = (event.x, event.y)
+        self._saw_position(pos)
+        return pos
+
+    def get_event(self, timeout=None):
+        """ Get the next thing the terminal has sent us (a parser.Text,
+        parser.Key, parser.CPR, etc.), or None if nothing shows up within
+        timeout """
+        while not self._events:
+            if not self._parse_input(timeout):
+                return None
+        return self._events.pop(0)
+
+    def _expect(self, match, timeout=None):
+        """ Wait for an input event that match(event) accepts, and leave the
+        others queued for get_event().  We give up with TimeoutError when
+        timeout passes four times in a row with no input at all. """
+        found = []
+
+        def ready():
+            for i, event in enumerate(self._events):
+                if match(event):
+                    found.append(self._events.pop(i))
+                    return True
+            return False
+
+        self._expecting = match
+        try:
+            self._pump_until(ready, timeout)
+        finally:
+            self._expecting = None
+        return found[0]
 
     def read_Ps_response(self, terminator: chr, starter: chr = '[',
                          timeout=None):
@@ -379,64 +856,35 @@ class Terminal(SerialPort):
         ESC starter Ps ; Ps terminator
         ESC starter Ps ; Ps ; ... terminator
         """
-        # pylint: disable=too-many-nested-blocks,too-many-branches
 
-        timeout = self._get_timeout(timeout)
-        states = [
-            "\x1b",
-            "%c" % (starter,),
-            "0123456789;%c" % (terminator,),
-        ]
-        count = 0
-        val = 0
-        returns = []
-        seen_val = False
-        terminated = False
-
-        selector = selectors.PollSelector()
-        selector.register(self.filedes, selectors.EVENT_READ)
-
-        while not terminated:
-            events = selector.select(timeout=self._get_timeout())
-            if not events:
-                # print("read_Ps_response(): events: %s" % (events,))
-                count += 1
-                if count == 4:
-                    raise TimeoutError(timeout * count)
-                continue
+        self.flush()
+
+        def ps_values(event):
+            """ The Ps values from a response ending in terminator """
+            if starter is None or starter == '':
+                if isinstance(event, parser.Escape) and \
+                        event.final == terminator:
+                    return []
+                return None
+            if isinstance(event, parser.CPR) and terminator == 'R':
+                return [event.y, event.x]
+            if isinstance(event, parser.DSR) and terminator == 'n':
+                return [event.status]
+            if isinstance(event, parser.DA) and terminator == 'c':
+                return [val for val in event.options if val is not None]
+            if isinstance(event, parser.CSI) and event.final == terminator:
+                return [val for val in event.params if val is not None]
+            return None
 
-            # print("states: %s" % (states,))
-            for key, mask in events:
-                if mask & selectors.EVENT_READ:
-                    c = os.read(key.fd, 1).decode('utf8')
-                    # print("read_Ps_response: read '%c'" % (c,))
-                    count = 0
-                    if c in states[0]:
-                        if len(states) > 1:
-                            states.pop(0)
-                            continue
-                        elif c == ';':
-                            if seen_val:
-                                returns.append(val)
-                                val = 0
-                                seen_val = False
-                            continue
-                        elif c == terminator:
-                            if seen_val:
-                                returns.append(val)
-                            terminated = True
-                            break
-                        if len(states) == 1:
-                            seen_val = True
-                            val *= 10
-                            val += int(c)
-                    else:
-                        if self.seen_valid_ps:
-                            print("unexpected character '\\x%02x'" % (ord(c),))
-                        else:
-                            time.sleep(0.2)
-                        continue
-        selector.close()
+        try:
+            event = self._expect(lambda event: ps_values(event) is not None,
+                                 timeout)
+        except TimeoutError:
+            self.metrics.count("ps_response.timeouts")
+            self.metrics.trace("ps_response.timeout", name=self.name,
+                               terminator=terminator)
+            raise
+        returns = ps_values(event)
         if returns:
             self.seen_valid_ps = True
         return returns
@@ -444,18 +892,10 @@ class Terminal(SerialPort):
     def _CPR(self):
         """ Cursor Position Report - vt100 to host """
 
-        y = 1
-        x = 1
-        values = self.read_Ps_response(terminator='R')
-        if values:
-            y = values.pop(0)
-        if values:
-            x = values.pop(0)
-
-        while values:
-            val = values.pop(0)
-            print("CPR: unexpected value %d\n" % (val,))
-        return (x, y)
+        self.flush()
+        event = self._expect(lambda event: isinstance(event, parser.CPR))
+        self.seen_valid_ps = True
+        return (event.x, event.y)
 
     def CPR(self):
         """ Cursor Position Report - vt100 to host """
@@ -465,7 +905,7 @@ class Terminal(SerialPort):
             #print("(x, y) = (%d, %d)" % (x, y))
             return x, y
         except ValueError as e:
-            print("ValueError: %s" % (e,))
+            self.metrics.trace("cpr.error", name=self.name, error=str(e))
             # self.drain()
             # time.sleep(0.1)
 
@@ -473,37 +913,51 @@ class Terminal(SerialPort):
         """ CUU - Cursor Up - move cursor up (y-=n) - DEC is terrible """
         n = int(n)
         #print("CUU(%d)" % (n,))
-        self.escape("%dA" % (n,))
+        self._write(sequences.csi_n(n, 'A'))
         self.decrement_row(n)
 
     def CUD(self, n: int = 1):
         """ Cursor Down - move cursor down (y+=n) """
         n = int(n)
         #print("CUD(%d)" % (n,))
-        self.escape("%dB" % (n,))
-        self.decrement_row(n)
+        self._write(sequences.csi_n(n, 'B'))
+        self.increment_row(n)
 
     def CUF(self, n: int = 1):
         """ Cursor Foward - move the cursor right (x+=n) """
         n = int(n)
         #print("CUF(%d)" % (n,))
-        self.escape("%dC" % (n,))
+        self._write(sequences.csi_n(n, 'C'))
         self.increment_col(n)
 
     def CUB(self, n=1):
         """ Cursor Backward - move the cursor left (x-=n) """
         n = int(n)
         #print("CUB(%d)" % (n,))
-        self.escape("%dD" % (n,))
+        self._write(sequences.csi_n(n, 'D'))
         self.decrement_col(n)
 
+    def _check_bounds(self, x: int, y: int):
+        """ Make sure (x, y) is on the screen """
+        if x < self.min_x:
+            raise ValueError("x %d < min %d" % (x, self.min_x))
+        if x > self.max_x:
+            raise ValueError("x %d > max %d" % (x, self.max_x))
+        if y < self.min_y:
+            raise ValueError("y %d < min %d" % (y, self.min_y))
+        if y > self.max_y:
+            raise ValueError("y %d > max %d" % (y, self.max_y))
+
     def _CUP_and_HVP(self, cmd, x: int = None, y: int = None, force=False):
         """ implement CUP and HVP """
         # This is awesomely backwards - first param is which line, second is
         # which column.
 
         if x is None and y is None:
-            self.escape("[%c" % (cmd,))
+            if cmd == 'H':
+                self._write(sequences.CUP_HOME)
+            else:
+                self._write(sequences.HVP_HOME)
             self.fill(4)
             self.set_position(1, 1)
             return
@@ -511,14 +965,7 @@ class Terminal(SerialPort):
         x = int(x)
         y = int(y)
         if not force:
-            if x < self.min_x:
-                raise ValueError("x %d < min %d" % (x, self.min_x))
-            if x > self.max_x:
-                raise ValueError("x %d > max %d" % (x, self.max_x))
-            if y < self.min_y:
-                raise ValueError("y %d < min %d" % (y, self.min_y))
-            if y > self.max_y:
-                raise ValueError("y %d > max %d" % (y, self.max_y))
+            self._check_bounds(x, y)
 
             if x == self.x and y == self.y:
                 self.count += 1
@@ -527,7 +974,7 @@ class Terminal(SerialPort):
                 return
         self.count = 0
 
-        self.escape("[%d;%d%c" % (y, x, cmd))
+        self._write(sequences.position(x, y, cmd))
         self.fill(self.speed / 5)
         #time.sleep(0.1)
 
@@ -540,15 +987,13 @@ class Terminal(SerialPort):
 
     def DA(self):
         """ Query device attributes """
-        self.escape("0c")
+        return self.query_attributes().result()
 
-        c = os.read(self.filedes, 5).decode('utf8')
-        if c != "\x1b[?1;":
-            raise ValueError("\"%s\" should be \"\\x1b[?1;\"" % (c,))
-
-        c = os.read(self.filedes, 2).decode('utf8')
-        if c[1] != 'c':
-            raise ValueError("\\x%02x should be [" % (c[1],))
+    @staticmethod
+    def _DA_answer(options):
+        """ Describe the options in a DA response """
+        if not options or options[0] != 1:
+            raise ValueError("DA %s should start with 1" % (options,))
 
         answers = [
             "No options",
@@ -561,7 +1006,9 @@ class Terminal(SerialPort):
             "GPO, STP, and AVO",
             ]
 
-        c = int(c[0])
+        c = 0
+        if len(options) > 1 and options[1]:
+            c = options[1]
         if c > 7:
             raise ValueError("%d should be 0..7" % (c,))
 
@@ -598,20 +1045,13 @@ class Terminal(SerialPort):
 
     def _DSR(self, n: int = 0):
         """ Device Status Report """
-        self.escape("[%dn" % (n,))
-        self.fill(2000)
         if n == 5:
-            dsr = os.read(self.filedes, 4).decode('utf8')
-            if dsr[0:2] != "\x1b[" or dsr[3] != 'n':
-                raise ValueError("\"%s\" should be \"\\x1b[Pn\"" % (dsr,))
-            return int(dsr[2])
-        elif n == 6:
-            try:
-                return self.CPR()
-            except TimeoutError:
-                print("CPR timed out; re-issuing DSR")
-                self.drain()
-                return self._DSR(n)
+            return self.query_status().result()
+        if n == 6:
+            return self._ask(self.query_position())
+        self._write(sequences.csi_n(n, 'n'))
+        self.fill(2000)
+        return None
 
     def DSR(self, n: int = 0):
         """ Device Status Report """
@@ -624,13 +1064,17 @@ class Terminal(SerialPort):
         if (erase_from_start and erase_to_end) or \
                 (not erase_from_start and not erase_to_end):
             #print("ED(2)")
-            self.escape("[%dJ" % (2,))
+            self._write(sequences.ED[2])
         elif erase_from_start:
             #print("ED(1)")
-            self.escape("[%dJ" % (1,))
+            self._write(sequences.ED[1])
         elif erase_to_end:
             #print("ED(0)")
-            self.escape("[%dJ" % (0,))
+            self._write(sequences.ED[0])
+        if erase_from_start == erase_to_end:
+            self.screen.erase_shown()
+        else:
+            self.screen.invalidate()
         self.fill(104)
         self.fill(19200 / 5)
 
@@ -640,18 +1084,18 @@ class Terminal(SerialPort):
         if (erase_from_start and erase_to_end) or \
                 (not erase_from_start and not erase_to_end):
             #print("EL(2)")
-            self.escape("[%dK" % (2,))
+            self._write(sequences.EL[2])
         elif erase_from_start:
             #print("EL(1)")
-            self.escape("[%dK" % (1,))
+            self._write(sequences.EL[1])
         elif erase_to_end:
             #print("EL(0)")
-            self.escape("[%dK" % (0,))
+            self._write(sequences.EL[0])
         self.fill(80)
 
     def HTS(self):
         """ Horizontal Tab Set (at current position) """
-        self.escape("H")
+        self._write(sequences.HTS)
 
     def HVP(self, x: int = None, y: int = None, force=False):
         """ Horizontal and Vertical Position - aka CUP """
@@ -661,17 +1105,17 @@ class Terminal(SerialPort):
     def IND(self):
         """ Index - move active position one line down, scroll if bottom """
         #print("IND")
-        self.escape("D")
+        self._write(sequences.IND)
         self.fill(32)
         self.increment_line()
 
-        self.check_position()
+        self._auto_check_position()
 
     def NEL(self):
         """ Next Line - move the active position to the first character of the
         next line, scrolling if needed """
         #print("NEL")
-        self.escape("E")
+        self._write(sequences.NEL)
         fill = 32
         if self.scroll_enabled:
             if self.cur_y == self.Pb:
@@ -689,19 +1133,23 @@ class Terminal(SerialPort):
         """ Reverse Index - move active position up one line, scroll if needed
         """
         #print("RI")
-        self.escape("M")
+        self._write(sequences.RI)
         self.fill(32)
         self.decrement_line()
 
-        self.check_position()
+        self._auto_check_position()
 
     def RIS(self):
         """ Reset To Initial State """
         #print("RIS")
         # reset the terminal the proper DEC way
-        self.escape("c")
-        self.escape("c")
-        self.escape("c")
+        self._write(sequences.RIS * 3)
+        self.rendition = A_NORMAL
+        self.Pt = self.min_y
+        self.Pb = self.max_y
+        self.scroll_enabled = False
+        self._homed()
+        self.screen.erase_shown()
         self.fill(19200*8)
 
     # skipping...
@@ -712,46 +1160,31 @@ class Terminal(SerialPort):
     #    """ Select Character Set """
     #
 
-    def SGR(self, **kwargs):
-        """ SGR - Select Graphic Rendition - Set a character attribute """
-        attributes = {
-            "attributes_off": "0",  # vt100 vt102 w60
-            "bold": "1",            # vt100 vt102 w60
-            "dim": "2",             #             w60
-            "underline": "4",       # vt100 vt102 w60
-            "blink": "5",           # vt100 vt102 w60
-            "reverse": "7",         # vt100 vt102 w60
-            "invisible": "8",       #             w60
-            "normal": "22",         #             w60
-            "underline_off": "24",  #             w60
-            "blink_off": "25",      #             w60
-            "reverse_off": "27",    #             w60
-        }
-
-        keys = set(kwargs.keys())
-        if keys.issuperset(set(["bold", "dim"])) or \
-                keys.issuperset(set(["bold", "invisible"])) or \
-                keys.issuperset(set(["dim", "invisible"])):
-            raise ValueError("bold, dim, and invisible cannot be combined")
-
-        params = ""
+    @staticmethod
+    def _SGR_params(kwargs):
+        """ The SGR parameters for SGR()'s keyword arguments """
+        for pair in _SGR_EXCLUSIVE:
+            if pair.issubset(kwargs):
+                raise ValueError("bold, dim, and invisible cannot be combined")
+
+        params = []
         for key in kwargs:
-            if not key in attributes:
+            if not key in _SGR_PARAMS:
                 raise TypeError(
                     "%s() got an unexpected keyword argument '%s'" %
                     (__name__, key))
-            params += "%s;" % (attributes[key],)
-
-        if params.endswith(";"):
-            params = params[:-1]
-        else:
-            params = "0"
+            params.append(_SGR_PARAMS[key])
+        return tuple(params)
 
-        self.escape("[%sm" % (params,))
+    def SGR(self, **kwargs):
+        """ SGR - Select Graphic Rendition - Set a character attribute """
+        params = self._SGR_params(kwargs)
+        self._write(sequences.sgr(params))
+        self.rendition = sequences.apply_sgr(self.rendition, params)
 
     def TBC(self, Ps=0):
         """ Tabular Clear -- 0 clears current position, 3 clears all """
-        self.escape("[%dg" % (Ps,))
+        self._write(sequences.csi_n(Ps, 'g'))
 
     def set_autowrap(self, enable=True):
         """ autowrap
@@ -772,7 +1205,7 @@ class Terminal(SerialPort):
         self.saved_y = self.cur_y
         self.cursor_saved = True
         #print("save(%d,%d)" % (self.cur_x, self.cur_y))
-        self.escape("[s")
+        self._write(sequences.SCOSC)
         self.fill(2)
 
     def cursor_restore(self):
@@ -780,10 +1213,11 @@ class Terminal(SerialPort):
         #print("doing cursor_restore")
         self.cur_x = self.saved_x
         self.cur_y = self.saved_y
+        self.wrap_pending = False
         #print("restore(%d,%d)" % (self.cur_x, self.cur_y))
-        self.escape("[u")
+        self._write(sequences.SCORC)
         self.fill(2)
-        self.check_position()
+        self._auto_check_position()
 
     def cursor_save_with_attrs(self):
         """ save the current cursor position and attrs """
@@ -793,9 +1227,10 @@ class Terminal(SerialPort):
         #print("doing cursor_save_with_attrs")
         self.saved_x = self.cur_x
         self.saved_y = self.cur_y
+        self.saved_rendition = self.rendition
         self.cursor_saved = True
         #print("save(%d,%d)" % (self.cur_x, self.cur_y))
-        self.escape("7")
+        self._write(sequences.DECSC)
         self.fill(self.speed * 0.01)
 
     def cursor_restore_with_attrs(self):
@@ -808,31 +1243,44 @@ class Terminal(SerialPort):
             pass
         self.cur_x = self.saved_x
         self.cur_y = self.saved_y
+        self.rendition = self.saved_rendition
+        self.wrap_pending = False
         #print("restore(%d,%d)" % (self.cur_x, self.cur_y))
-        self.escape("8")
+        self._write(sequences.DECRC)
         self.fill(self.speed * 0.01)
-        self.check_position()
+        self._auto_check_position()
 
     def set_alt_keypad_mode(self, enabled=True):
         """ numlock """
         if enabled:
-            self.escape('=')
+            self._write(sequences.DECKPAM)
         else:
-            self.escape('>')
+            self._write(sequences.DECKPNM)
 
     def gotoxy(self, x=None, y=None, force=False):
-        """ Go to (x, y) """
-        self.CUP(x, y, force)
-        self.fill(2)
+        """ Go to (x, y), taking the cheapest route unless forced """
+        if force or x is None or y is None:
+            self.CUP(x, y, force)
+            self.fill(2)
+            return
+
+        x = int(x)
+        y = int(y)
+        self._check_bounds(x, y)
+        self._move(x, y)
+        self.set_position(x, y)
 
     def getpos(self):
         """ get current (x, y) """
-        ret = self.DSR(6)
-        if ret[0] > self.max_x:
-            self.max_x = ret[0]
-        if ret[1] > self.max_y:
-            self.max_y = ret[1]
-        return ret
+        return self.DSR(6)
+
+    def _saw_position(self, pos):
+        """ The terminal says the cursor is at pos, so the screen is at
+        least that big """
+        if pos[0] > self.max_x:
+            self.max_x = pos[0]
+        if pos[1] > self.max_y:
+            self.max_y = pos[1]
 
     def gohome(self):
         """ move the cursor to the origin at (1,1) """
@@ -850,7 +1298,7 @@ class Terminal(SerialPort):
     def scroll_up(self):
         """ scroll the scroll region up one line. """
         # "reverse index" in DEC manuals
-        self.escape("M")
+        self._write(sequences.RI)
 
     def scroll_down(self, n=1):
         """ scroll the scroll region down one line. """
@@ -862,11 +1310,11 @@ class Terminal(SerialPort):
             while n > 0:
                 n -= 1
                 self.gotoxy(80, self.Pb)
-                self.escape("E")
+                self._write(sequences.NEL)
                 #self.write("\r\n")
             self.gotoxy(x, y)
             self.cursor_restore_with_attrs()
-        self.check_position()
+        self._auto_check_position()
 
         #self.write("\r\n")
         #self.escape("D%d" % (n,))
@@ -874,7 +1322,7 @@ class Terminal(SerialPort):
 
     def enq(self):
         """ Send ENQ to request the answerback message """
-        self.escape("\x05")
+        self._write(sequences.ENQ)
         # do more here?
 
     def scroll_enable(self, Pt=None, Pb=None):
@@ -883,7 +1331,8 @@ class Terminal(SerialPort):
             self.Pt = self.min_y
             self.Pb = self.max_y
             self.scroll_enabled = False
-            self.escape("[r")
+            self._write(sequences.DECSTBM_RESET)
+            self._homed()
             return
 
         if Pt is None:
@@ -908,7 +1357,8 @@ class Terminal(SerialPort):
         self.Pt = Pt
         self.Pb = Pb
         self.scroll_enabled = True
-        self.escape("[%d;%dr" % (Pt, Pb))
+        self._write(sequences.stbm(Pt, Pb))
+        self._homed()
 
     def next_line(self):
         """ Next Line - move the active position to the first character of the
@@ -918,7 +1368,7 @@ class Terminal(SerialPort):
     def wrap(self, enable=True):
         """ Enable or disable line line wrapping mode """
         if enable:
-            self.escape("[?7h")
+            self._write(sequences.DECAWM_ON)
         else:
             # The DEC manual tries to fight its typography to become more
             # clear here, and makes it completely less clear. It has a
@@ -927,11 +1377,21 @@ class Terminal(SerialPort):
             # where <set code> is ESC[?7H and <reset code> is ESC[?7* ,
             # and at the bottom of the page it says:
             # * The last character of the sequence is a lowercase L (154[8])
-            self.escape("[?7l")
-
-    def set_attribute(self, *args, **kwargs):
-        """ set character attribute (bright, underscore, etc) """
-        self.SGR(*args, **kwargs)
+            self._write(sequences.DECAWM_OFF)
+
+    def set_attribute(self, attrs: int = None, **kwargs):
+        """ set character attribute (bright, underscore, etc), sending only
+        what has to change.  attrs is the whole rendition as A_* bits; or
+        pass keyword arguments as for SGR(), which apply on top of the
+        rendition in effect now. """
+        if attrs is None:
+            attrs = sequences.apply_sgr(self.rendition,
+                                        self._SGR_params(kwargs))
+            if attrs is None:
+                # relative to a rendition we don't know
+                self.SGR(**kwargs)
+                return
+        self._set_attrs(attrs)
 
     def getxy(self):
         " get the current cursor position - note that this is entirely faked"
@@ -943,26 +1403,184 @@ class Terminal(SerialPort):
         """ clear the screen """
         self.ED(True, True)
 
+    def draw(self, x: int, y: int, text: str, attrs: int = A_NORMAL):
+        """ Draw text with attrs into the screen model at (x, y).  Nothing
+        is sent until refresh(). """
+        self.screen.put(x, y, text, attrs)
+
+    def _move(self, x: int, y: int, attrs: int = None):
+        """ Move the cursor to (x, y) the cheapest way we can find, without
+        checking where we ended up.  If attrs is the rendition currently in
+        effect, reprinting known cells from the screen model is allowed. """
+        # a move to where we are is nothing, unless there's a wrap pending:
+        # the next character would still go to the next line.
+        if x == self.cur_x and y == self.cur_y and not self.wrap_pending:
+            return
+
+        known = None
+        if attrs is not None:
+            known = functools.partial(self.screen.shown_text, y=y,
+                                      attrs=attrs)
+
+        # CUU and CUD stop at the scrolling margins, and LF scrolls at the
+        # bottom one, so leaving the region from inside it takes a CUP.
+        relative_ok = not self.scroll_enabled or \
+                not (self.cur_y <= self.Pb < y or y < self.Pt <= self.cur_y)
+
+        self.planner.byte_time = 10 / self.speed
+        self.planner.cup_delay = self._fill_time(self.speed / 5)
+        seq, _, absolute = self.planner.plan(self.cur_x, self.cur_y, x, y,
+                                             known, lf_ok=not self.onlcr,
+                                             relative_ok=relative_ok,
+                                             wrap_pending=self.wrap_pending)
+        self._write(seq)
+        if absolute:
+            self.fill(self.speed / 5)
+        self.cur_x = x
+        self.cur_y = y
+        self.wrap_pending = False
+
+    def _set_attrs(self, attrs: int):
+        """ Select the graphic rendition for a set of screen attributes,
+        sending as little as we can """
+        seq = sequences.sgr_change(self.rendition, attrs, self.sgr_off_codes)
+        if seq:
+            self._write(seq)
+            self.rendition = attrs
+
+    def refresh(self):
+        """ Send the parts of the screen model that have changed since the
+        last refresh.  Anything written around the model (write(), EL(),
+        etc.) isn't tracked; call self.screen.invalidate() after doing
+        that to repaint everything. """
+        with self.batch():
+            for x, y, text, run_attrs in self.screen.changes():
+                self._move(x, y, self.rendition)
+                self._set_attrs(run_attrs)
+                self._write(text)
+                self.advance(text)
+
+    def _forget_input(self):
+        """ Throw away the input we've got so far, parsed or not, and fail
+        the queries waiting on it, without waiting for any more """
+        self._rbuf.clear()
+        self._events.clear()
+        self.parser.reset()
+        # anything we were waiting on isn't coming now
+        while self._queries:
+            self._queries.popleft().error = TimeoutError()
+
     def drain(self):
         """ drain the file descriptor of its output, we've lost track """
 
-        selector = selectors.PollSelector()
-        selector.register(self.filedes, selectors.EVENT_READ)
+        self._forget_input()
         count = 0
 
         while True:
-            events = selector.select(timeout=self._get_timeout())
-            if not events:
+            if not self._fill_input(self._get_timeout()):
                 count += 1
                 if count == 4:
                     break
-            for key, mask in events:
-                if mask & selectors.EVENT_READ:
-                    os.read(key.fd, 1)
-                    count = 0
-        selector.close()
+                continue
+            self._rbuf.clear()
+            count = 0
+
+class QueuedTerminal(Terminal):
+    """ A Terminal whose drawing methods don't block.
+
+    Output is queued along with the pacing delays fill() would have slept
+    for, and sent by send_ready(), which never blocks, or send_all(),
+    which does.  AsyncTerminal and TerminalPool are built on this.
+
+    We can't stop and ask the terminal where the cursor is in the middle
+    of a drawing method, so the cursor model is always trusted; call
+    check_position() when you want to compare notes.
+    """
+
+    def __init__(self, name, use_pty=False, selector=None, profiles=None,
+                 fast_probe=False, metrics=None):
+        # pylint: disable=too-many-arguments
+        Terminal.__init__(self, name, use_pty, trust_model=True,
+                          check_every=0, selector=selector,
+                          profiles=profiles, fast_probe=fast_probe,
+                          metrics=metrics)
+        # [data, n] pairs: send data, then fill(n)
+        self._segments = collections.deque()
+
+    def _write(self, buf, timeout=None):
+        """ Queue output to be sent """
+        if isinstance(buf, str):
+            buf = buf.encode('utf-8')
+        self._outbuf += buf
+        return len(buf)
+
+    def flush(self, timeout=None, fill=0):
+        """ Move output queued by _write() onto the send queue, followed by
+        a delay of fill.  Nothing is actually sent here. """
+        # pylint: disable=arguments-differ
+        if self._outbuf:
+            self._segments.append([bytes(self._outbuf), fill])
+            self._outbuf.clear()
+        elif self._segments:
+            self._segments[-1][1] += fill
+        elif fill:
+            # everything has gone out already, so the delay starts now.
+            self.pacer.delay(fill)
+        return 0
+
+    def fill(self, n, obey_our_dec_masters=False):
+        """ Queue a delay of n after what we've queued """
+        if obey_our_dec_masters:
+            self._write("\x00" * n)
+            return
+        self.flush(fill=n)
+
+    @property
+    def queued(self):
+        """ is there output we haven't sent yet? """
+        return bool(self._segments or self._outbuf)
+
+    def send_ready(self):
+        """ Send as much of the queue as the terminal and the port will
+        take right now, without blocking.  Returns True once it's all
+        gone. """
+        self.flush()
+        while self._segments:
+            if not self.pacer.ready():
+                return False
+            segment = self._segments[0]
+            data, fill = segment
+            if data:
+                try:
+                    n = self._write_some(data)
+                except BlockingIOError:
+                    return False
+                self.pacer.sent(n)
+                if n < len(data):
+                    segment[0] = data[n:]
+                    return False
+            self._segments.popleft()
+            if fill:
+                self.pacer.delay(fill)
+        return True
+
+    def send_all(self, timeout=None):
+        """ Send the whole queue, waiting out its delays """
+        while not self.send_ready():
+            wait = self.pacer.wait_time()
+            if wait > 0:
+                time.sleep(wait)
+            elif not self._wait(selectors.EVENT_WRITE, timeout):
+                raise TimeoutError()
+
+    def _pump_until(self, ready, timeout=None):
+        """ Send everything queued, then parse input until ready() """
+        self.send_all()
+        Terminal._pump_until(self, ready, timeout)
 
 __all__ = [
+    "QueuedTerminal",
+    "Query",
     "Terminal",
 ]
 
@@ -0,0 +1,109 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+This module runs a terminal on a thread of its own, so other threads can
+draw on it without waiting.
+"""
+import concurrent.futures
+import queue
+import threading
+
+from .terminal import QueuedTerminal
+
+class ThreadedTerminal():
+    """ A QueuedTerminal owned by a writer thread.
+
+    Any thread may call the terminal's methods through this object; each
+    call is put on a queue and returns a concurrent.futures.Future right
+    away, and the writer thread makes the calls in order.  After running
+    everything that's waiting in the queue, the writer sends the output
+    they produced together, sleeping out pacing delays itself.  Queries
+    like getpos() and DA() work the same way; their Future's result() is
+    the answer.
+
+    Only the writer thread touches the terminal's state, so there's no
+    locking to get wrong.  Attributes that aren't methods are read
+    straight from the terminal, so they may be a little behind.
+    """
+
+    def __init__(self, name, use_pty=False, **kwargs):
+        """ kwargs go to QueuedTerminal """
+        self.terminal = QueuedTerminal(name, use_pty, **kwargs)
+        self._commands = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name="terminal %s" % (self.name,))
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name == "terminal":
+            raise AttributeError(name)
+        attr = getattr(self.terminal, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self.submit(attr, *args, **kwargs)
+        call.__name__ = name
+        call.__doc__ = attr.__doc__
+        return call
+
+    def submit(self, fn, *args, **kwargs):
+        """ Have the writer thread call fn(*args, **kwargs); returns a
+        Future for what it returns """
+        if self._closed:
+            raise RuntimeError("ThreadedTerminal %s is closed" % (self.name,))
+        future = concurrent.futures.Future()
+        self._commands.put((future, fn, args, kwargs))
+        return future
+
+    def sync(self):
+        """ A Future that's done once everything asked for so far has been
+        sent to the terminal """
+        return self.submit(self.terminal.send_all)
+
+    def close(self, timeout=None):
+        """ Finish what's been asked for, then stop the writer thread """
+        if not self._closed:
+            self._closed = True
+            self._commands.put(None)
+        self._thread.join(timeout)
+
+    def _call(self, command):
+        """ Make one call from the queue """
+        future, fn, args, kwargs = command
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as error: # pylint: disable=broad-except
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _run(self):
+        """ The writer thread """
+        while True:
+            command = self._commands.get()
+            while command is not None:
+                self._call(command)
+                try:
+                    command = self._commands.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                self.terminal.send_all()
+            except OSError:
+                # what didn't go out stays queued, and the next send will
+                # try it again.
+                pass
+            if command is None:
+                return
+
+__all__ = [
+    "ThreadedTerminal",
+]
@@ -0,0 +1,33 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+Tests for AsyncTerminal.
+"""
+import asyncio
+
+import pytest
+
+from terminal import AsyncTerminal
+from terminal.emulator import Emulator
+
+def test_blocking_queries_raise():
+    """ the blocking ways of waiting for an answer don't stall the event
+    loop, but the async ones still get it """
+    t = AsyncTerminal("test", use_pty=True)
+    emulator = Emulator.attach(t).start()
+    try:
+        t.gotoxy(5, 7)
+        with pytest.raises(RuntimeError):
+            t.query_position().result()
+        with pytest.raises(RuntimeError):
+            t.read_Ps_response('R')
+        with pytest.raises(RuntimeError):
+            t.CPR()
+        assert asyncio.run(t.getpos()) == (5, 7)
+    finally:
+        emulator.stop()
+        t.close()
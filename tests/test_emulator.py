@@ -0,0 +1,253 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+These tests drive the whole Terminal stack over a pty, with an Emulator
+on the other end standing in for the hardware.
+"""
+import random
+import time
+
+import pytest
+
+from terminal import Terminal
+from terminal.emulator import Emulator
+from terminal.metrics import Metrics
+from terminal.screen import A_NORMAL, A_BOLD, A_DIM, A_UNDERLINE, A_BLINK, \
+        A_REVERSE, A_INVISIBLE
+
+@pytest.fixture(name="term")
+def _term():
+    """ A trusted-model Terminal that's been set up, and its Emulator """
+    t = Terminal("test", use_pty=True, trust_model=True, fast_probe=True)
+    emulator = Emulator.attach(t).start()
+    t.setup()
+    yield t, emulator
+    emulator.stop()
+    t.close()
+
+def sync(t):
+    """ Ask the emulator where its cursor is; since it answers in order,
+    that also waits for it to carry out everything we sent before """
+    return t.getpos()
+
+def assert_screens_match(t, emulator):
+    """ Every cell of the screen model is what the emulator shows """
+    sync(t)
+    for y in range(1, t.max_y + 1):
+        for x in range(1, t.max_x + 1):
+            assert emulator.get(x, y) == t.screen.get(x, y), (x, y)
+
+@pytest.mark.parametrize("size,probed,sent", [
+    # (width, height), (max_x, max_y) found by _probe_geometry(), and the
+    # bytes it sends; the fast probe always finds the real size.  The old
+    # one only ever grows the 80x24 default, it scrolls down 30 lines,
+    # and 999 spaces wrap back to the left well short of the last column.
+    ((80, 24), (80, 24), 1134),
+    ((132, 24), (80, 24), 1134),
+    ((90, 30), (80, 30), 1141),
+    ((40, 12), (80, 24), 1141),
+    ((80, 50), (80, 36), 1141),
+])
+@pytest.mark.parametrize("fast_probe", [False, True])
+def test_probes(size, probed, sent, fast_probe):
+    """ what each of setup()'s probes finds, and what it sends finding
+    it, on screens of several sizes """
+    metrics = Metrics()
+    t = Terminal("test", use_pty=True, trust_model=True,
+                 fast_probe=fast_probe, metrics=metrics)
+    emulator = Emulator.attach(t, width=size[0], height=size[1]).start()
+    try:
+        t.setup()
+        if fast_probe:
+            probed = size
+            sent = 64
+        assert (t.min_x, t.min_y, t.max_x, t.max_y) == (1, 1) + probed
+        assert metrics.snapshot()["counters"]["write.bytes"] == sent
+        assert sync(t) == (t.x, t.y) == (1, 1)
+    finally:
+        emulator.stop()
+        t.close()
+
+def test_setup_measures_emulator(term):
+    """ setup() finds the emulator's geometry and leaves us at home """
+    t, emulator = term
+    assert (t.max_x, t.max_y) == (emulator.width, emulator.height)
+    assert sync(t) == (t.x, t.y) == (1, 1)
+
+def test_refresh_matches_emulator(term):
+    """ refresh() leaves the emulator showing the screen model, both for
+    a full repaint and for a change to one line """
+    t, emulator = term
+    rand = random.Random(0)
+    attrs = (A_NORMAL, A_BOLD, A_UNDERLINE, A_REVERSE, A_BOLD | A_BLINK,
+             A_DIM | A_UNDERLINE | A_REVERSE)
+
+    def scribble(y):
+        for x in range(1, t.max_x + 1, 8):
+            text = "".join(rand.choice("abcdef ") for i in range(8))
+            t.draw(x, y, text, rand.choice(attrs))
+
+    for y in range(1, t.max_y + 1):
+        scribble(y)
+    t.refresh()
+    assert_screens_match(t, emulator)
+
+    scribble(7)
+    t.draw(30, 12, "changed", A_BOLD)
+    t.refresh()
+    assert_screens_match(t, emulator)
+
+    # and a full repaint, which invalidate() forces
+    t.screen.invalidate()
+    t.refresh()
+    assert_screens_match(t, emulator)
+
+@pytest.mark.parametrize("start,end", [
+    ((5, 19), (5, 21)),     # down out of the region past Pb
+    ((5, 6), (5, 3)),       # up out of the region past Pt
+    ((9, 10), (3, 12)),     # inside the region
+    ((5, 2), (5, 22)),      # from above the region to below it
+    ((5, 22), (5, 2)),      # from below the region to above it
+    ((1, 20), (1, 21)),     # LF at Pb would scroll
+    ((70, 4), (2, 5)),      # into the region from above
+])
+def test_moves_across_margins(term, start, end):
+    """ gotoxy() ends up where it says it does with a scrolling region
+    set, even though CUU, CUD and LF stop at its margins """
+    t, _ = term
+    t.scroll_enable(5, 20)
+    assert sync(t) == (t.x, t.y)
+    t.gotoxy(*start)
+    assert sync(t) == start
+    t.gotoxy(*end)
+    assert sync(t) == (t.x, t.y) == end
+
+def test_cursor_relative_moves_stop_at_margins(term):
+    """ CUD and CUU stop at the margins in the model too """
+    t, _ = term
+    t.scroll_enable(5, 20)
+    t.gotoxy(5, 10)
+    t.CUD(30)
+    assert sync(t) == (t.x, t.y) == (5, 20)
+    t.CUU(30)
+    assert sync(t) == (t.x, t.y) == (5, 5)
+
+def test_scroll_enable_and_ris_home_the_cursor(term):
+    """ DECSTBM and RIS move the cursor, and the model follows """
+    t, emulator = term
+    t.gotoxy(10, 10)
+    t.scroll_enable(5, 20)
+    assert sync(t) == (t.x, t.y) == (1, 1)
+    t.gotoxy(10, 10)
+    assert sync(t) == (10, 10)
+    t.RIS()
+    assert sync(t) == (t.x, t.y) == (1, 1)
+    assert (t.Pt, t.Pb, t.scroll_enabled) == (1, t.max_y, False)
+    assert (emulator.top, emulator.bottom) == (1, emulator.height)
+
+@pytest.mark.parametrize("text", [
+    "hello",
+    "x" * 80,
+    "x" * 85,
+    "abc\rde",
+    "abc\bd\b\b",
+    "a\tb\tc",
+    "one\ntwo\n",
+    "tail\r\nhead",
+    "\t" * 12,
+    "w" * 80 + "\r",
+])
+def test_advance_tracks_cursor(term, text):
+    """ advance() models printing, wrapping, and control characters the
+    way the terminal carries them out """
+    t, _ = term
+    t.gotoxy(3, 20)
+    t.write(text, limit=len(text))
+    assert sync(t) == (t.x, t.y)
+
+@pytest.mark.parametrize("y", [5, 24])
+def test_redraw_last_column(term, y):
+    """ drawing the last column again goes there, not to the next line,
+    even though the first one left a wrap pending """
+    t, emulator = term
+    t.draw(80, y, "X")
+    t.refresh()
+    t.draw(80, y, "Y")
+    t.refresh()
+    assert sync(t) == (t.x, t.y) == (80, y)
+    assert emulator.get(80, y)[0] == "Y"
+    assert_screens_match(t, emulator)
+
+def test_gotoxy_from_last_column(term):
+    """ gotoxy() to the last column we just printed in cancels the wrap """
+    t, emulator = term
+    t.gotoxy(80, 3)
+    t.write("a", limit=1)
+    t.gotoxy(80, 3)
+    t.write("b", limit=1)
+    assert sync(t) == (t.x, t.y) == (80, 3)
+    assert emulator.text(3).endswith("b")
+    assert emulator.text(4).strip() == ""
+
+def test_onlcr(term, monkeypatch):
+    """ with a tty turning LF into CR LF, advance() follows it and moves
+    down don't count on LF staying put """
+    t, emulator = term
+    monkeypatch.setattr(Terminal, "onlcr", True)
+    # the emulator's newline mode does what ONLCR would
+    emulator.newline_mode = True
+    t.gotoxy(10, 3)
+    t.write("ab\ncd\n", limit=6)
+    assert sync(t) == (t.x, t.y) == (1, 5)
+    t.gotoxy(10, 6)
+    t.gotoxy(10, 8)
+    assert sync(t) == (t.x, t.y) == (10, 8)
+
+def test_write_after_wrap(term):
+    """ a character after the last column goes to the next line """
+    t, emulator = term
+    t.gotoxy(78, 3)
+    t.write("abcde", limit=5)
+    assert sync(t) == (t.x, t.y) == (3, 4)
+    assert emulator.text(3).endswith("abc")
+    assert emulator.text(4).startswith("de")
+
+@pytest.mark.parametrize("off_codes", [True, False])
+def test_set_attribute_matches_emulator(term, off_codes):
+    """ after a run of attribute changes, each character was drawn in
+    the rendition we asked for """
+    t, emulator = term
+    t.sgr_off_codes = off_codes
+    renditions = [A_BOLD, A_BOLD | A_UNDERLINE, A_UNDERLINE,
+                  A_UNDERLINE | A_REVERSE, A_NORMAL, A_DIM | A_BLINK,
+                  A_BLINK, A_INVISIBLE, A_REVERSE]
+    t.gotoxy(1, 5)
+    for attrs in renditions:
+        t.set_attribute(attrs)
+        t.write("x", limit=1)
+    t.set_attribute(underline=True)
+    t.write("y", limit=1)
+    sync(t)
+    for x, attrs in enumerate(renditions, 1):
+        assert emulator.get(x, 5) == ("x", attrs)
+    assert emulator.get(len(renditions) + 1, 5) == \
+            ("y", A_REVERSE | A_UNDERLINE)
+    assert emulator.attrs == t.rendition
+
+def test_query_timeout_starts_after_output(monkeypatch):
+    """ a query doesn't time out while what was sent before it is still
+    on its way to the terminal """
+    t = Terminal("test", use_pty=True, trust_model=True)
+    try:
+        # as though a slow line had another half second left to send
+        done_at = time.monotonic() + 0.5
+        monkeypatch.setattr(t.pacer, "done_at", lambda: done_at)
+        with pytest.raises(TimeoutError):
+            t.read_Ps_response('R', timeout=0.01)
+        assert time.monotonic() >= done_at
+    finally:
+        t.close()
@@ -0,0 +1,31 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+Tests for what a Terminal counts in its Metrics.
+"""
+import os
+
+from terminal import Terminal
+from terminal.metrics import Metrics
+
+def test_metrics_from_the_constructor():
+    """ a Terminal given its own Metrics counts into it from the start,
+    including input that arrives while read_Ps_response() waits """
+    traced = []
+    metrics = Metrics(tracer=lambda event, fields: traced.append(event))
+    t = Terminal("test", use_pty=True, trust_model=True, metrics=metrics)
+    try:
+        assert t.metrics is metrics
+        assert "terminal.open" in traced
+        # a keypress, then the reply we're waiting for
+        # pylint: disable=protected-access
+        os.write(t._slave_pty, b"x\x1b[5;7R")
+        assert t.read_Ps_response('R', timeout=1) == [5, 7]
+        assert metrics.snapshot()["counters"]["input.stray"] == 1
+        assert len(t._events) == 1
+    finally:
+        t.close()
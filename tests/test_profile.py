@@ -0,0 +1,45 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+Tests for ProfileCache.
+"""
+from terminal import ProfileCache
+from terminal.profile import Profile
+
+def profile(identity, max_x=80):
+    """ a Profile for identity measured at 19200 baud """
+    return Profile(1, 1, max_x, 24, identity, 19200, 0.01)
+
+def test_answerback_doesnt_pass_for_da(tmp_path):
+    """ an answerback that looks like DA parameters is a different
+    terminal from the one with those parameters """
+    path = str(tmp_path / "profiles.json")
+    cache = ProfileCache(path)
+    cache.store("/dev/ttyS0", profile(("da", (1, 2)), 80))
+    cache.store("/dev/ttyS0", profile(("answerback", "1;2"), 132))
+
+    cache = ProfileCache(path)
+    assert cache.lookup("/dev/ttyS0", ("da", (1, 2)), 19200).max_x == 80
+    assert cache.lookup("/dev/ttyS0", ("answerback", "1;2"),
+                        19200).max_x == 132
+    assert cache.lookup("/dev/ttyS0", ("da", (1, 2)), 9600) is None
+
+def test_forget_answerback_with_spaces(tmp_path):
+    """ forget() finds profiles whatever their identity looks like, and
+    leaves other ttys' alone """
+    path = str(tmp_path / "profiles.json")
+    cache = ProfileCache(path)
+    identity = ("answerback", "ACME VT 2")
+    cache.store("/dev/ttyS0", profile(identity))
+    cache.store("/dev/ttyS1", profile(identity))
+    cache.forget("/dev/ttyS0")
+
+    cache = ProfileCache(path)
+    assert cache.lookup("/dev/ttyS0", identity, 19200) is None
+    assert cache.lookup("/dev/ttyS1", identity, 19200) is not None
+    cache.forget()
+    assert cache.lookup("/dev/ttyS1", identity, 19200) is None
@@ -0,0 +1,37 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+Tests for recording a session and replaying it.
+"""
+from terminal import Terminal
+from terminal.emulator import Emulator
+from terminal.record import Recorder, Replayer
+
+def test_replay_terminal_into_terminal(tmp_path):
+    """ what a Terminal sent can be replayed into another Terminal """
+    path = str(tmp_path / "session")
+    t = Terminal("test", use_pty=True, trust_model=True)
+    emulator = Emulator.attach(t).start()
+    with Recorder(path) as recorder:
+        t.recorder = recorder
+        t.setup()
+        t.gotoxy(5, 5)
+        t.write("hello", limit=5)
+        t.getpos()
+    emulator.stop()
+    t.close()
+
+    replay = Terminal("test", use_pty=True, trust_model=True)
+    emulator = Emulator.attach(replay).start()
+    stats = Replayer(path, speed=None).replay(replay)
+    # the emulator answered the queries in the recording too
+    replay.drain()
+    assert replay.getpos() == (10, 5)
+    assert emulator.text(5).startswith("    hello")
+    assert stats["sent"] > 0 and stats["received"] == 0
+    emulator.stop()
+    replay.close()
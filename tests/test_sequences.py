@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+Tests for the precompiled escape sequences.
+"""
+import pytest
+
+from terminal import sequences
+from terminal.screen import A_NORMAL, A_BOLD, A_DIM, A_UNDERLINE, \
+        A_REVERSE, A_INVISIBLE
+
+@pytest.mark.parametrize("have,want,expected", [
+    (A_BOLD, A_BOLD, b""),
+    (A_NORMAL, A_BOLD, b"\x1b[1m"),
+    (A_BOLD, A_BOLD | A_UNDERLINE, b"\x1b[4m"),
+    (A_BOLD | A_UNDERLINE, A_UNDERLINE, b"\x1b[22m"),
+    (A_DIM | A_REVERSE, A_REVERSE, b"\x1b[22m"),
+    (A_BOLD | A_REVERSE | A_UNDERLINE, A_NORMAL, b"\x1b[0m"),
+    (A_BOLD, A_DIM, b"\x1b[0;2m"),
+    (A_BOLD | A_UNDERLINE, A_DIM | A_UNDERLINE, b"\x1b[22;2m"),
+    (A_INVISIBLE | A_BOLD, A_BOLD, b"\x1b[0;1m"),
+    (None, A_UNDERLINE, b"\x1b[0;4m"),
+])
+def test_sgr_change(have, want, expected):
+    """ sgr_change() sends only what changes, or the reset when that's
+    shorter """
+    assert sequences.sgr_change(have, want) == expected
+
+def test_sgr_change_without_off_codes():
+    """ a vt100 only has SGR 0 for turning things off """
+    assert sequences.sgr_change(A_BOLD | A_UNDERLINE, A_UNDERLINE,
+                                False) == b"\x1b[0;4m"
+    assert sequences.sgr_change(A_BOLD, A_BOLD, False) == b""
+
+@pytest.mark.parametrize("attrs,params,expected", [
+    (A_NORMAL, (), A_NORMAL),
+    (A_BOLD, (4,), A_BOLD | A_UNDERLINE),
+    (A_BOLD | A_DIM | A_REVERSE, (22,), A_REVERSE),
+    (A_BOLD | A_UNDERLINE, (0, 7), A_REVERSE),
+    (None, (4,), None),
+    (None, (0, 4), A_UNDERLINE),
+])
+def test_apply_sgr(attrs, params, expected):
+    """ apply_sgr() follows the rendition the way the terminal does, and
+    an unknown one stays unknown until a reset """
+    assert sequences.apply_sgr(attrs, params) == expected
@@ -0,0 +1,82 @@
+#!/usr/bin/python3
+#
+# Copyright 2017 Peter Jones <Peter Jones@random>
+#
+# Distributed under terms of the GPLv3 license.
+
+"""
+Tests for SerialPort, talking to the slave side of a pty directly.
+"""
+import os
+import selectors
+import tty
+
+import pytest
+
+from terminal import SerialPort
+
+@pytest.fixture(name="port")
+def _port():
+    """ A SerialPort on a pty, and the raw slave side to talk back on """
+    p = SerialPort("test", use_pty=True)
+    # pylint: disable=protected-access
+    slave = p._slave_pty
+    tty.setraw(slave)
+    yield p, slave
+    p.close()
+
+def test_readline_bad_utf8_stays_on_its_line(port):
+    """ a truncated character at the end of a line is replaced there, and
+    doesn't spill onto the next line """
+    p, slave = port
+    os.write(slave, b"bad \xe2\x82\nnext ok\n")
+    assert p.readline(1) == "bad �"
+    assert p.readline(1) == "next ok"
+
+def test_readline_split_character(port):
+    """ a character split by max_line comes out whole in the next piece """
+    p, slave = port
+    os.write(slave, "abcä\r\n".encode('utf-8'))
+    assert p.readline(1, max_line=4) == "abc"
+    assert p.readline(1, max_line=4) == "ä"
+
+def test_readline_invalid_bytes(port):
+    """ invalid UTF-8 in the middle of a line is replaced """
+    p, slave = port
+    os.write(slave, b"a\xffb\nc\n")
+    assert list(p.readlines(0.05)) == ["a�b", "c"]
+
+@pytest.mark.parametrize("data,lines", [
+    (b"abcd\nefg\n", ["abcd", "efg"]),
+    (b"abcdefgh\n", ["abcd", "efgh"]),
+    (b"abcdefghi\n", ["abcd", "efgh", "i"]),
+    (b"\n\nabcd\n", ["", "", "abcd"]),
+])
+def test_readline_max_line(port, data, lines):
+    """ a line of exactly max_line bytes still ends at its newline, and
+    longer ones are split into max_line pieces """
+    p, slave = port
+    os.write(slave, data)
+    assert list(p.readlines(0.05, max_line=4)) == lines
+
+def test_shared_selector_wait_leaves_no_registration():
+    """ a port that's done waiting on a shared selector doesn't leave its
+    ready fd to wake up the next port that waits on it """
+    selector = selectors.DefaultSelector()
+    ports = [SerialPort("test", use_pty=True, selector=selector)
+             for i in range(2)]
+    try:
+        # pylint: disable=protected-access
+        for p in ports:
+            tty.setraw(p._slave_pty)
+        os.write(ports[0]._slave_pty, b"unread\n")
+        assert ports[0]._wait(selectors.EVENT_READ, 1)
+        assert not selector.get_map()
+        before = ports[1].metrics.snapshot()["counters"]["poll.wakeups"]
+        assert ports[1]._wait(selectors.EVENT_READ, 0.2) == 0
+        after = ports[1].metrics.snapshot()["counters"]["poll.wakeups"]
+        assert after - before == 1
+    finally:
+        for p in ports:
+            p.close()
+        selector.close()